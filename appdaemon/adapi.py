@@ -1,7 +1,9 @@
 import datetime
+import functools
 import inspect
 import iso8601
 import re
+from copy import deepcopy
 from datetime import timedelta
 
 import appdaemon.utils as utils
@@ -186,10 +188,10 @@ class ADAPI:
 
     def friendly_name(self, entity_id, **kwargs):
         self._check_entity(self._get_namespace(**kwargs), entity_id)
-        state = self.get_state(**kwargs)
-        if entity_id in state:
-            if "friendly_name" in state[entity_id]["attributes"]:
-                return state[entity_id]["attributes"]["friendly_name"]
+        state = self.get_state(entity_id, attribute="all", **kwargs)
+        if state is not None:
+            if "friendly_name" in state["attributes"]:
+                return state["attributes"]["friendly_name"]
             else:
                 return entity_id
         return None
@@ -318,17 +320,33 @@ class ADAPI:
 
         return self._AD.state.get_state(self.name, namespace, entity_id, attribute, **kwargs)
 
+    def get_history(self, entity_id, since=None, limit=None, **kwargs):
+        namespace = self._get_namespace(**kwargs)
+        if namespace not in self._AD.history:
+            raise ValueError("{}: History is not enabled for namespace {}".format(self.name, namespace))
+        if isinstance(since, datetime.timedelta):
+            since = self.get_now() - since
+        elif since is not None:
+            since = self._AD.sched.convert_naive(since)
+        return self._AD.state.get_history(namespace, entity_id, since, limit)
+
     def set_state(self, entity_id, **kwargs):
         self.logger.debug("set state: %s, %s", entity_id, kwargs)
         namespace = self._get_namespace(**kwargs)
-        self._check_entity(namespace, entity_id)
         if "namespace" in kwargs:
             del kwargs["namespace"]
 
-        old_state = self._AD.state.get_state(self.name, namespace, entity_id)
-        new_state = self._AD.state.parse_state(entity_id, namespace, **kwargs)
+        return self.set_states({entity_id: kwargs}, namespace=namespace)[entity_id]
+
+    def set_states(self, states, **kwargs):
+        self.logger.debug("set states: %s", states)
+        namespace = self._get_namespace(**kwargs)
+        for entity_id in states:
+            self._check_entity(namespace, entity_id)
+
+        # Update _AD's Copy - all entities under a single lock
 
-        self._AD.state.set_state_simple(namespace, entity_id, new_state)
+        events = self._AD.state.set_states_simple(namespace, states)
 
         # Fire the plugin's state update if it has one
 
@@ -336,26 +354,21 @@ class ADAPI:
 
         if hasattr(plugin, "set_plugin_state"):
             # We assume that the state change will come back to us via the plugin
-            plugin.set_plugin_state(namespace, entity_id, new_state, **kwargs)
+            for event in events:
+                entity_id = event["data"]["entity_id"]
+                plugin.set_plugin_state(namespace, entity_id, event["data"]["new_state"], **states[entity_id])
         else:
-            # Just fire the event locally
+            # Just fire the events locally, in one hop to the loop
 
-            data = \
-                        {
-                            "event_type": "state_changed",
-                            "data":
-                                {
-                                    "entity_id": entity_id,
-                                    "new_state": new_state,
-                                    "old_state": old_state
-                                }
-                        }
+            self._AD.thread_async.call_async_no_wait(self._AD.events.process_events, namespace, events)
 
-            self._AD.thread_async.call_async_no_wait(self._AD.events.process_event, namespace, data)
-
-        # Update _AD's Copy
+        # The new states are shared, so hand them back the same way get_state() does
+        if self._AD.state_copy is True:
+            result = deepcopy
+        else:
+            result = utils.freeze_state
 
-        return new_state
+        return {event["data"]["entity_id"]: result(event["data"]["new_state"]) for event in events}
 
     #
     # Events
@@ -545,7 +558,9 @@ class ADAPI:
             event = datetime.datetime.combine(today, when)
             if event < now:
                 event = event + datetime.timedelta(days=1)
-            handle = self.run_every(callback, event, 24 * 60 * 60, **kwargs)
+            self.logger.debug("Registering run_daily starting %s for %s", event, self.name)
+            handle = self._AD.sched.insert_schedule(self.name, self._AD.sched.convert_naive(event), callback, True, "daily",
+                                                    interval=24 * 60 * 60, **kwargs)
         elif info["sun"] == "sunrise":
             kwargs["offset"] = info["offset"]
             handle = self.run_at_sunrise(callback, **kwargs)
@@ -591,6 +606,28 @@ class ADAPI:
                                                 interval=interval, **kwargs)
         return handle
 
+    def run_cron(self, callback, expr, **kwargs):
+        name = self.name
+        kwargs["cron"] = expr
+        if "exclude_dates" in kwargs:
+            # Stored as ISO strings so the timer can be saved with the rest of the schedule
+            kwargs["exclude_dates"] = [self._cron_date(date) for date in kwargs["exclude_dates"]]
+        # Compiling here means a bad expression is reported to the caller
+        event = self._AD.sched.get_next_cron(kwargs, self.get_now())
+
+        self.logger.debug("Registering run_cron '%s' starting %s for %s", expr, event, name)
+
+        handle = self._AD.sched.insert_schedule(name, event, callback, True, "cron", **kwargs)
+        return handle
+
+    @staticmethod
+    def _cron_date(date):
+        if isinstance(date, datetime.datetime):
+            date = date.date()
+        if isinstance(date, datetime.date):
+            return date.isoformat()
+        return date
+
     def _schedule_sun(self, name, type_, callback, **kwargs):
         event = self._AD.sched.sun[type_]
         handle = self._AD.sched.insert_schedule(
@@ -628,6 +665,10 @@ class ADAPI:
     def run_in_thread(self, callback, thread):
         self.run_in(callback, 0, pin=False, pin_thread=thread)
 
+    def run_in_executor(self, func, *args, **kwargs):
+        # Lets async callbacks make blocking calls such as call_service() without stalling the loop
+        return utils.run_in_executor(self._AD.loop, self._AD.executor, functools.partial(func, *args, **kwargs))
+
     def get_thread_info(self):
         return self._AD.threading.get_thread_info()
 
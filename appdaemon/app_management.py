@@ -1,4 +1,5 @@
 import threading
+import asyncio
 import sys
 import traceback
 import uuid
@@ -12,6 +13,7 @@ import pstats
 import logging
 
 import appdaemon.utils as utils
+import appdaemon.app_process as app_process
 from appdaemon.appdaemon import AppDaemon
 
 class AppManagement:
@@ -81,6 +83,35 @@ class AppManagement:
             else:
                 return None
 
+    def on_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.AD.loop
+        except RuntimeError:
+            return False
+
+    def call_app_function(self, name, function):
+        if not asyncio.iscoroutinefunction(function):
+            function()
+        elif self.on_loop():
+            # Blocking here would deadlock the loop, so let it run as a task instead
+            self.AD.loop.create_task(self.run_app_coroutine(name, function))
+        else:
+            # We are in the executor, so run it on the loop and wait for it to complete
+            asyncio.run_coroutine_threadsafe(function(), self.AD.loop).result()
+
+    async def run_app_coroutine(self, name, function):
+        try:
+            await function()
+        except:
+            error_logger = logging.getLogger("Error.{}".format(name))
+            error_logger.warning('-' * 60)
+            error_logger.warning("Unexpected error running %s() for %s", function.__name__, name)
+            error_logger.warning('-' * 60)
+            error_logger.warning(traceback.format_exc())
+            error_logger.warning('-' * 60)
+            if self.AD.logging.separate_error_log() is True:
+                self.logger.warning("Logged an error to %s", self.AD.logging.get_filename("error_log"))
+
     def initialize_app(self, name):
         with self.objects_lock:
             if name in self.objects:
@@ -95,8 +126,10 @@ class AppManagement:
 
         try:
             if self.AD.threading.validate_callback_sig(name, "initialize", init):
-                init()
+                self.call_app_function(name, init)
                 self.set_state(name, state="idle")
+                if self.AD.persist_schedule is True:
+                    self.AD.sched.restore_app(name)
         except:
             error_logger = logging.getLogger("Error.{}".format(name))
             error_logger.warning('-' * 60)
@@ -120,7 +153,7 @@ class AppManagement:
 
         if term is not None:
             try:
-                term()
+                self.call_app_function(name, term)
                 self.set_state(name, state="terminated")
             except:
                 error_logger = logging.getLogger("Error.{}".format(name))
@@ -132,12 +165,19 @@ class AppManagement:
                 if self.AD.logging.separate_error_log() is True:
                     self.logger.warning("Logged an error to %s", self.AD.logging.get_filename("error_log"))
 
+        process = None
         with self.objects_lock:
             if name in self.objects:
+                process = self.objects[name].get("process")
                 del self.objects[name]
 
+        if process is not None:
+            process.stop()
+
         self.AD.callbacks.clear_callbacks(name)
 
+        self.AD.threading.clear_async(name)
+
         self.AD.sched.terminate_app(name)
 
         if self.AD.http is not None:
@@ -180,6 +220,12 @@ class AppManagement:
                         "pin_thread": pin
                     }
 
+                    execution = app_args.get("execution", "thread")
+                    if execution == "process":
+                        self.objects[name]["process"] = app_process.AppProcess(self.AD, name, self.objects[name]["object"])
+                    elif execution != "thread":
+                        self.logger.warning("Unknown execution mode '%s' for %s - using threads", execution, name)
+
         else:
             self.logger.warning("Unable to find module module %s - %s is not initialized", app_args["module"], name)
 
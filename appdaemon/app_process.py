@@ -0,0 +1,305 @@
+import asyncio
+import importlib
+import inspect
+import logging
+import multiprocessing
+import pickle
+import threading
+import traceback
+import types
+import uuid
+from collections.abc import Mapping
+
+from appdaemon.appdaemon import AppDaemon
+
+
+class ProcessAppError(Exception):
+    pass
+
+
+class AppMethod:
+
+    """
+    Stands in for a method of the app while it is passed between AppDaemon and the app's process,
+    e.g. a callback given to listen_state()
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+
+def convert(value, leaf):
+    if isinstance(value, Mapping):
+        return {key: convert(item, leaf) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [convert(item, leaf) for item in value]
+    elif isinstance(value, tuple):
+        return tuple(convert(item, leaf) for item in value)
+    else:
+        return leaf(value)
+
+
+def picklable(values):
+    result = {}
+    for key, value in values.items():
+        try:
+            pickle.dumps(value)
+            result[key] = value
+        except Exception:
+            pass
+    return result
+
+
+def is_framework(cls):
+    return cls.__module__.split(".")[0] in ("appdaemon", "builtins")
+
+
+class Channel:
+
+    """
+    Request/reply messaging over a multiprocessing Pipe. Each request is handled on its own thread so that
+    either side can call back into the other while a request is outstanding.
+    """
+
+    def __init__(self, conn, handler, encode, decode):
+        self.conn = conn
+        self.handler = handler
+        self.encode = encode
+        self.decode = decode
+        self.send_lock = threading.Lock()
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.closed = False
+
+    def send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+    def call(self, method, args, kwargs):
+        id_ = uuid.uuid4().hex
+        event = threading.Event()
+        with self.pending_lock:
+            if self.closed:
+                raise ProcessAppError("App process is not running")
+            self.pending[id_] = [event, None]
+        try:
+            self.send(("request", id_, method, self.encode(args), self.encode(kwargs)))
+        except:
+            with self.pending_lock:
+                self.pending.pop(id_, None)
+            raise
+        event.wait()
+        with self.pending_lock:
+            ok, value = self.pending.pop(id_)[1]
+        if ok:
+            return self.decode(value)
+        raise ProcessAppError(value)
+
+    def notify(self, method, args, kwargs):
+        self.send(("notify", None, method, self.encode(args), self.encode(kwargs)))
+
+    def listen(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == "reply":
+                _, id_, ok, value = message
+                with self.pending_lock:
+                    if id_ in self.pending:
+                        self.pending[id_][1] = (ok, value)
+                        self.pending[id_][0].set()
+            elif message[0] == "stop":
+                break
+            else:
+                t = threading.Thread(target=self.handle, args=(message,))
+                t.daemon = True
+                t.start()
+        self.close()
+
+    def handle(self, message):
+        kind, id_, method, args, kwargs = message
+        try:
+            result = (True, self.encode(self.handler(method, self.decode(args), self.decode(kwargs))))
+        except:
+            result = (False, traceback.format_exc())
+        if kind == "request":
+            try:
+                self.send(("reply", id_) + result)
+            except:
+                # Most likely the result couldn't be pickled
+                self.send(("reply", id_, False, traceback.format_exc()))
+
+    def close(self):
+        with self.pending_lock:
+            self.closed = True
+            for id_ in self.pending:
+                self.pending[id_][1] = (False, "App process has exited")
+                self.pending[id_][0].set()
+
+
+class AppProcess:
+
+    """
+    Hosts the code of an app with "execution: process" in a worker subprocess. The app object created by
+    AppManagement stays in AppDaemon and keeps all of the app's callbacks and state, but the methods the user
+    wrote are replaced by stubs that run them in the subprocess. There, the API methods are in turn forwarded
+    back to the app object in AppDaemon.
+    """
+
+    def __init__(self, ad: AppDaemon, name, app):
+
+        self.AD = ad
+        self.name = name
+        self.app = app
+        self.logger = ad.logging.get_child("_app_process")
+
+        context = multiprocessing.get_context("spawn")
+        conn, child_conn = context.Pipe()
+        self.channel = Channel(conn, self.handle_request, self.encode, self.decode)
+        self.process = context.Process(
+            target=run_app,
+            args=(child_conn, name, type(app).__module__, type(app).__name__,
+                  app.args, picklable(app.config), app.app_config),
+            name="app-{}".format(name)
+        )
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+        self.listener = threading.Thread(target=self.channel.listen, name="app_process-{}".format(name))
+        self.listener.daemon = True
+        self.listener.start()
+
+        self.install_stubs()
+        self.logger.info("Started process %s for app %s", self.process.pid, name)
+
+    def install_stubs(self):
+        for cls in type(self.app).__mro__:
+            if is_framework(cls):
+                continue
+            for name, function in vars(cls).items():
+                if inspect.isfunction(function) and not name.startswith("__") and name not in self.app.__dict__:
+                    setattr(self.app, name, types.MethodType(self.make_stub(name, function), self.app))
+
+    def make_stub(self, name, function):
+        channel = self.channel
+
+        def stub(self, *args, **kwargs):
+            return channel.call(name, args, kwargs)
+
+        stub.__name__ = function.__name__
+        stub.__qualname__ = function.__qualname__
+        # So validate_callback_sig() sees the signature of the real method
+        stub.__signature__ = inspect.signature(function)
+        return stub
+
+    def encode(self, value):
+        def leaf(item):
+            if getattr(item, "__self__", None) is self.app:
+                return AppMethod(item.__name__)
+            return item
+        return convert(value, leaf)
+
+    def decode(self, value):
+        def leaf(item):
+            if isinstance(item, AppMethod):
+                return getattr(self.app, item.name)
+            return item
+        return convert(value, leaf)
+
+    def handle_request(self, method, args, kwargs):
+        if method == "__log__":
+            logger, level, msg = args
+            getattr(self.app, logger).log(level, msg)
+            return None
+        return getattr(self.app, method)(*args, **kwargs)
+
+    def stop(self):
+        try:
+            self.channel.send(("stop",))
+        except (OSError, ValueError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.logger.warning("Process for app %s did not stop - terminating it", self.name)
+            self.process.terminate()
+        self.channel.close()
+
+
+#
+# Subprocess side
+#
+
+class ForwardHandler(logging.Handler):
+
+    def __init__(self, channel, logger):
+        super().__init__()
+        self.channel = channel
+        self.logger = logger
+
+    def emit(self, record):
+        try:
+            self.channel.notify("__log__", (self.logger, record.levelno, self.format(record)), {})
+        except:
+            self.handleError(record)
+
+
+def run_app(conn, name, module, class_name, args, config, app_config):
+    app_class = getattr(importlib.import_module(module), class_name)
+    app = app_class.__new__(app_class)
+
+    def encode(value):
+        def leaf(item):
+            if getattr(item, "__self__", None) is app:
+                return AppMethod(item.__name__)
+            return item
+        return convert(value, leaf)
+
+    def decode(value):
+        def leaf(item):
+            if isinstance(item, AppMethod):
+                return getattr(app, item.name)
+            return item
+        return convert(value, leaf)
+
+    def handler(method, args, kwargs):
+        result = getattr(app, method)(*args, **kwargs)
+        if inspect.iscoroutine(result):
+            result = asyncio.run(result)
+        return result
+
+    channel = Channel(conn, handler, encode, decode)
+
+    def make_forwarder(method):
+        def forwarder(*args, **kwargs):
+            return channel.call(method, args, kwargs)
+        forwarder.__name__ = method
+        return forwarder
+
+    app.name = name
+    app.args = args
+    app.config = config
+    app.app_config = app_config
+    app.global_vars = {}
+    app.lock = threading.RLock()
+    app.constraints = []
+    app.logger = logging.getLogger("app_process.{}".format(name))
+    app.logger.addHandler(ForwardHandler(channel, "logger"))
+    app.logger.setLevel(logging.DEBUG)
+    app.logger.propagate = False
+    app.err = logging.getLogger("app_process.{}.error".format(name))
+    app.err.addHandler(ForwardHandler(channel, "err"))
+    app.err.propagate = False
+
+    # API methods run on the app object in AppDaemon
+
+    for cls in app_class.__mro__:
+        if not is_framework(cls) or cls is object:
+            continue
+        for method, function in vars(cls).items():
+            if inspect.isfunction(function) and not method.startswith("_") and method not in app.__dict__:
+                setattr(app, method, make_forwarder(method))
+
+    channel.listen()
@@ -60,6 +60,10 @@ class AppDaemon:
 
         self.load_distribution = "roundrobbin"
         utils.process_arg(self, "load_distribution", kwargs)
+        # The docs spell it "roundrobin", the default has always been "roundrobbin"
+        if self.load_distribution not in ("roundrobin", "roundrobbin", "load", "random"):
+            self.logger.warning("Unknown load_distribution '%s' - using 'roundrobin'", self.load_distribution)
+            self.load_distribution = "roundrobin"
 
         self.app_dir = None
         utils.process_arg(self, "app_dir", kwargs)
@@ -93,18 +97,36 @@ class AppDaemon:
         self.tick = 1
         utils.process_arg(self, "tick", kwargs, float=True)
 
+        self.scheduler_mode = "tick"
+        utils.process_arg(self, "scheduler_mode", kwargs)
+        if self.scheduler_mode not in ("tick", "event"):
+            self.logger.warning("Unknown scheduler_mode '%s' - using 'tick'", self.scheduler_mode)
+            self.scheduler_mode = "tick"
+
+        self.persist_schedule = False
+        utils.process_arg(self, "persist_schedule", kwargs)
+
+        self.persist_schedule_interval = 60
+        utils.process_arg(self, "persist_schedule_interval", kwargs, int=True)
+
         self.max_clock_skew = 1
         utils.process_arg(self, "max_clock_skew", kwargs, int=True)
 
         self.thread_duration_warning_threshold = 10
         utils.process_arg(self, "thread_duration_warning_threshold", kwargs, float=True)
 
+        self.async_callback_limit = 10
+        utils.process_arg(self, "async_callback_limit", kwargs, int=True)
+
         self.threadpool_workers = 10
         utils.process_arg(self, "threadpool_workers", kwargs, int=True)
 
         self.endtime = None
         utils.process_arg(self, "endtime", kwargs)
 
+        self.fast_forward = False
+        utils.process_arg(self, "fast_forward", kwargs)
+
         self.interval = 1
         if kwargs["interval"] is None:
             self.interval = self.tick
@@ -123,6 +145,9 @@ class AppDaemon:
         self.admin_delay = 1
         utils.process_arg(self, "admin_delay", kwargs, int=True)
 
+        self.admin_stats_interval = 1
+        utils.process_arg(self, "admin_stats_interval", kwargs, float=True)
+
         self.max_utility_skew = self.utility_delay * 0.9
         utils.process_arg(self, "max_utility_skew", kwargs, float=True)
 
@@ -153,6 +178,12 @@ class AppDaemon:
         self.namespaces = {}
         utils.process_arg(self, "namespaces", kwargs)
 
+        self.state_copy = False
+        utils.process_arg(self, "state_copy", kwargs)
+
+        self.history = {}
+        utils.process_arg(self, "history", kwargs)
+
         self.exclude_dirs = ["__pycache__"]
         if "exclude_dirs" in kwargs:
             self.exclude_dirs += kwargs["exclude_dirs"]
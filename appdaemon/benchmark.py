@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+import sys
+import os
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import appdaemon.utils as utils
+import appdaemon.appdaemon as ad
+import appdaemon.logging as logging
+
+#
+# Stub app used to own the timers - callbacks do nothing so we only measure AppDaemon
+#
+
+STUB_APP = """
+import adbase as ad
+
+
+class BenchmarkApp(ad.ADBase):
+
+    def initialize(self):
+        self.adapi = self.get_ad_api()
+
+    def noop(self, kwargs):
+        pass
+"""
+
+STUB_APP_CONFIG = """
+benchmark_app:
+  module: benchmark_app
+  class: BenchmarkApp
+"""
+
+TIMER_KINDS = ["run_in", "run_every", "run_daily", "run_at_sunrise", "run_at_sunset"]
+
+
+class SchedulerBenchmark:
+
+    """
+    Builds an AppDaemon instance with a single stub app and measures how the scheduler
+    scales with synthetic timer populations
+    """
+
+    def __init__(self, sizes, ticks, burst, seed, log_level):
+        self.sizes = sizes
+        self.ticks = ticks
+        self.burst = burst
+        self.seed = seed
+        self.AD = None
+        self.api = None
+        self.callback = None
+        self.now = None
+
+        self.config_dir = tempfile.mkdtemp(prefix="appdaemon_benchmark_")
+        app_dir = os.path.join(self.config_dir, "apps")
+        os.makedirs(app_dir)
+        with open(os.path.join(app_dir, "benchmark_app.py"), "w") as fh:
+            fh.write(STUB_APP)
+        with open(os.path.join(app_dir, "apps.yaml"), "w") as fh:
+            fh.write(STUB_APP_CONFIG)
+
+        self.logging = logging.Logging({}, log_level)
+        self.logger = self.logging.get_logger()
+
+    def appdaemon_config(self):
+        return {
+            "config_dir": self.config_dir,
+            "app_dir": os.path.join(self.config_dir, "apps"),
+            # As main.py does - the file doesn't exist so apps.yaml is read from app_dir
+            "app_config_file": os.path.join(self.config_dir, "apps.yaml"),
+            "module_debug": {},
+            "latitude": 51.5,
+            "longitude": -0.1,
+            "elevation": 0,
+            "time_zone": "Europe/London",
+            # Time travel keeps the clock under our control and turns off skew detection
+            "starttime": "2019-01-01 00:00:00",
+            "tick": 1,
+            "interval": 1,
+            "production_mode": True,
+            "disable_apps": False,
+        }
+
+    def run(self):
+        try:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            self.AD = ad.AppDaemon(self.logging, loop, **self.appdaemon_config())
+            task = loop.create_task(self.run_benchmarks())
+            all_tasks = getattr(asyncio, "all_tasks", None) or asyncio.Task.all_tasks
+            pending = all_tasks(loop)
+            loop.run_until_complete(asyncio.gather(*pending))
+            return task.result()
+        finally:
+            shutil.rmtree(self.config_dir, ignore_errors=True)
+
+    async def wait_for_startup(self, timeout=60):
+        start = time.time()
+        while time.time() - start < timeout:
+            if self.AD.sched is not None:
+                app = self.AD.app_management.get_app("benchmark_app")
+                if app is not None and hasattr(app, "adapi"):
+                    return app
+            await asyncio.sleep(0.1)
+        raise ValueError("Timed out waiting for benchmark app to initialize")
+
+    async def run_benchmarks(self):
+        results = {
+            "version": utils.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.datetime.now().isoformat(),
+            "seed": self.seed,
+            "ticks": self.ticks,
+            "burst": self.burst,
+            "results": []
+        }
+        try:
+            app = await self.wait_for_startup()
+            self.api = app.adapi
+            self.callback = app.noop
+
+            # We drive the scheduler directly so stop its own timer loop
+            self.AD.sched.stop()
+            await asyncio.sleep(0.5)
+            self.now = self.AD.sched.get_now()
+
+            for size in self.sizes:
+                self.logger.info("Benchmarking scheduler with %s timers", size)
+                results["results"].append(await self.run_size(size))
+        finally:
+            self.AD.stop()
+
+        return results
+
+    async def drain(self):
+        # Let admin entity updates queued by the scheduler catch up
+        await self.AD.thread_async.join()
+        await utils.run_in_executor(self.AD.loop, self.AD.executor, self.AD.threading.wait_for_idle)
+
+    def insert_timers(self, size):
+        rand = random.Random(self.seed)
+        handles = []
+        counts = {kind: 0 for kind in TIMER_KINDS}
+        for i in range(size):
+            kind = TIMER_KINDS[i % len(TIMER_KINDS)]
+            counts[kind] += 1
+            if kind == "run_in":
+                handle = self.api.run_in(self.callback, rand.randint(1, 86400))
+            elif kind == "run_every":
+                start = self.api.get_now() + datetime.timedelta(seconds=rand.randint(1, 3600))
+                handle = self.api.run_every(self.callback, start, rand.randint(60, 3600))
+            elif kind == "run_daily":
+                handle = self.api.run_daily(self.callback, datetime.time(rand.randint(0, 23), rand.randint(0, 59), rand.randint(0, 59)))
+            elif kind == "run_at_sunrise":
+                handle = self.api.run_at_sunrise(self.callback, offset=rand.randint(-3600, 3600))
+            else:
+                handle = self.api.run_at_sunset(self.callback, offset=rand.randint(-3600, 3600))
+            handles.append(handle)
+        return handles, counts
+
+    def cancel_timers(self, handles):
+        for handle in handles:
+            self.api.cancel_timer(handle)
+
+    async def run_tick(self, seconds):
+        self.now = self.now + datetime.timedelta(seconds=seconds)
+        start = time.perf_counter()
+        await self.AD.sched.do_every_tick(self.now)
+        return time.perf_counter() - start
+
+    async def run_size(self, size):
+        result = {"timers": size}
+
+        #
+        # Memory - traced separately as tracemalloc slows everything else down
+        #
+
+        await self.drain()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        handles, counts = self.insert_timers(size)
+        await self.drain()
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        self.cancel_timers(handles)
+        await self.drain()
+        result["mix"] = counts
+        result["memory_bytes"] = after - before
+        result["memory_bytes_per_timer"] = round((after - before) / size, 1)
+
+        #
+        # Insert and cancel throughput
+        #
+
+        start = time.perf_counter()
+        handles, counts = self.insert_timers(size)
+        elapsed = time.perf_counter() - start
+        result["insert_per_second"] = round(size / elapsed, 1)
+        await self.drain()
+
+        #
+        # Per tick compute time with the population in place
+        #
+
+        durations = []
+        for i in range(self.ticks):
+            durations.append(await self.run_tick(1))
+            await self.drain()
+        result["tick"] = summarize(durations)
+
+        #
+        # Burst - a tick with a large number of timers due at once
+        #
+
+        burst = []
+        for i in range(self.burst):
+            burst.append(self.api.run_in(self.callback, 1))
+        await self.drain()
+        elapsed = await self.run_tick(1)
+        result["burst_timers"] = self.burst
+        result["burst_tick_seconds"] = round(elapsed, 6)
+        result["exec_per_second"] = round(self.burst / elapsed, 1) if elapsed > 0 else None
+        await self.drain()
+
+        start = time.perf_counter()
+        self.cancel_timers(handles)
+        elapsed = time.perf_counter() - start
+        result["cancel_per_second"] = round(size / elapsed, 1)
+        await self.drain()
+
+        return result
+
+
+def summarize(durations):
+    ordered = sorted(durations)
+    count = len(ordered)
+
+    def percentile(p):
+        return round(ordered[min(count - 1, int(count * p))], 6)
+
+    return {
+        "count": count,
+        "mean_seconds": round(sum(ordered) / count, 6),
+        "p50_seconds": percentile(0.5),
+        "p95_seconds": percentile(0.95),
+        "max_seconds": round(ordered[-1], 6),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AppDaemon scheduler benchmarks")
+    parser.add_argument("-s", "--sizes", help="timer population sizes to test", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("-t", "--ticks", help="number of ticks to time for each population", type=int, default=100)
+    parser.add_argument("-b", "--burst", help="number of timers due in the burst tick", type=int, default=1000)
+    parser.add_argument("-r", "--seed", help="random seed for the timer mix", type=int, default=1)
+    parser.add_argument("-o", "--output", help="write JSON results to this file instead of stdout", type=str, default=None)
+    parser.add_argument("-D", "--debug", help="log level", default="WARNING", choices=
+                        [
+                            "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"
+                        ])
+
+    args = parser.parse_args()
+
+    benchmark = SchedulerBenchmark(args.sizes, args.ticks, args.burst, args.seed, args.debug)
+    results = benchmark.run()
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,113 @@ class Callbacks:
         self.logger = ad.logging.get_child("_callbacks")
         self.diag = ad.logging.get_diag()
 
+        # State callbacks indexed as namespace -> domain -> entity -> handle -> app name,
+        # with None as the domain or entity for callbacks listening to everything below it
+        self.state_index = {}
+
+        # Event callbacks indexed as namespace -> event type -> handle -> app name,
+        # with None as the event type for listeners to all events
+        self.event_index = {}
+
+    #
+    # State callback index - locking performed in calling function
+    #
+
+    @staticmethod
+    def split_entity(entity):
+        if entity is None:
+            return None, None
+        elif "." not in entity:
+            return entity, None
+        else:
+            return tuple(entity.split(".", 1))
+
+    def add_state_index(self, name, handle, namespace, entity):
+        domain, entity = self.split_entity(entity)
+        self.state_index.setdefault(namespace, {}).setdefault(domain, {}).setdefault(entity, {})[handle] = name
+
+    def remove_state_index(self, handle, callback):
+        domain, entity = self.split_entity(callback["entity"])
+        namespace = callback["namespace"]
+        try:
+            handles = self.state_index[namespace][domain][entity]
+        except KeyError:
+            return
+        handles.pop(handle, None)
+        # Prune empty buckets so the index doesn't grow with churn
+        if not handles:
+            del self.state_index[namespace][domain][entity]
+            if not self.state_index[namespace][domain]:
+                del self.state_index[namespace][domain]
+                if not self.state_index[namespace]:
+                    del self.state_index[namespace]
+
+    def get_state_callbacks(self, namespace, entity_id):
+        domain, entity = self.split_entity(entity_id)
+        if namespace == "global":
+            namespaces = list(self.state_index.keys())
+        else:
+            namespaces = [namespace, "global"]
+
+        matches = []
+        for ns in namespaces:
+            domains = self.state_index.get(ns)
+            if domains is None:
+                continue
+            if None in domains:
+                matches.extend(domains[None].get(None, {}).items())
+            if domain in domains:
+                entities = domains[domain]
+                if None in entities:
+                    matches.extend(entities[None].items())
+                if entity is not None and entity in entities:
+                    matches.extend(entities[entity].items())
+        return matches
+
+    #
+    # Event callback index - locking performed in calling function
+    #
+
+    def add_event_index(self, name, handle, namespace, event):
+        self.event_index.setdefault(namespace, {}).setdefault(event, {})[handle] = name
+
+    def remove_event_index(self, handle, callback):
+        namespace = callback["namespace"]
+        event = callback["event"]
+        try:
+            handles = self.event_index[namespace][event]
+        except KeyError:
+            return
+        handles.pop(handle, None)
+        if not handles:
+            del self.event_index[namespace][event]
+            if not self.event_index[namespace]:
+                del self.event_index[namespace]
+
+    def get_event_callbacks(self, namespace, event):
+        if namespace == "global":
+            namespaces = list(self.event_index.keys())
+        else:
+            namespaces = [namespace, "global"]
+
+        matches = []
+        for ns in namespaces:
+            events = self.event_index.get(ns)
+            if events is None:
+                continue
+            if event in events:
+                matches.extend(events[event].items())
+            # Listeners to all events don't see system events (events that start with __)
+            if None in events and event[:2] != "__":
+                matches.extend(events[None].items())
+        return matches
+
+    def has_event_callback(self, name, event):
+        with self.callbacks_lock:
+            for events in self.event_index.values():
+                if name in events.get(event, {}).values():
+                    return True
+        return False
 
     #
     # Diagnostic
@@ -68,9 +175,11 @@ class Callbacks:
             if name in self.callbacks:
                 for id in self.callbacks[name]:
                     if self.callbacks[name][id]["type"] == "event":
+                        self.remove_event_index(id, self.callbacks[name][id])
                         self.AD.thread_async.call_async_no_wait(self.AD.state.remove_entity, "admin",
                                                             "event_callback.{}".format(id))
                     if self.callbacks[name][id]["type"] == "state":
+                        self.remove_state_index(id, self.callbacks[name][id])
                         self.AD.thread_async.call_async_no_wait(self.AD.state.remove_entity, "admin",
                                                             "state_callback.{}".format(id))
 
@@ -46,6 +46,7 @@ class Events:
                         "pin_thread": pin_thread,
                         "kwargs": kwargs
                     }
+                self.AD.callbacks.add_event_index(_name, handle, namespace, event)
                 self.AD.thread_async.call_async_no_wait(self.AD.state.add_entity, "admin", "event_callback.{}".format(handle), "active", {"app": _name, "event_name": event, "function": cb.__name__, "pinned": pin_app, "pinned_thread": pin_thread, "fired": 0, "executed": 0, "kwargs": kwargs})
             return handle
         else:
@@ -54,6 +55,7 @@ class Events:
     def cancel_event_callback(self, name, handle):
         with self.AD.callbacks.callbacks_lock:
             if name in self.AD.callbacks.callbacks and handle in self.AD.callbacks.callbacks[name]:
+                self.AD.callbacks.remove_event_index(handle, self.AD.callbacks.callbacks[name][handle])
                 del self.AD.callbacks.callbacks[name][handle]
                 self.AD.thread_async.call_async_no_wait(self.AD.state.remove_entity, "admin",
                                                     "event_callback.{}".format(handle))
@@ -114,47 +116,51 @@ class Events:
             self.logger.warning(traceback.format_exc())
             self.logger.warning('-' * 60)
 
+    async def process_events(self, namespace, events):
+        #
+        # A batch of events from a single call, e.g. set_states(). Only the hop from the app's thread to the loop
+        # is batched - each event still gets its own callbacks and its own stream update, as the dashboard
+        # protocol is one message per event.
+        #
+        for data in events:
+            await self.process_event(namespace, data)
+
     async def process_event_callbacks(self, namespace, data):
         with self.AD.callbacks.callbacks_lock:
-            for name in self.AD.callbacks.callbacks.keys():
-                for uuid_ in self.AD.callbacks.callbacks[name]:
-                    callback = self.AD.callbacks.callbacks[name][uuid_]
-                    if callback["namespace"] == namespace or callback[
-                        "namespace"] == "global" or namespace == "global":
-                        #
-                        # Check for either a blank event (for all events)
-                        # Or the event is a match
-                        # But don't allow a global listen for any system events (events that start with __)
-                        #
-                        if "event" in callback and (
-                                (callback["event"] is None and data['event_type'][:2] != "__")
-                                or data['event_type'] == callback["event"]):
-
-                            # Check any filters
-
-                            _run = True
-                            for key in callback["kwargs"]:
-                                if key in data["data"] and callback["kwargs"][key] != \
-                                        data["data"][key]:
-                                    _run = False
-
-                            if data["event_type"] == "__AD_LOG_EVENT":
-                                if "log" in callback["kwargs"] and callback["kwargs"]["log"] != data["data"]["log_type"]:
-                                    _run = False
-
-
-                            if _run:
-                                with self.AD.app_management.objects_lock:
-                                    if name in self.AD.app_management.objects:
-                                        await self.AD.threading.dispatch_worker(name, {
-                                            "id": uuid_,
-                                            "name": name,
-                                            "objectid": self.AD.app_management.objects[name]["id"],
-                                            "type": "event",
-                                            "event": data['event_type'],
-                                            "function": callback["function"],
-                                            "data": data["data"],
-                                            "pin_app": callback["pin_app"],
-                                            "pin_thread": callback["pin_thread"],
-                                            "kwargs": callback["kwargs"]
-                                        })
+            #
+            # The index returns callbacks for this event type plus listeners for all events,
+            # apart from system events (events that start with __)
+            #
+            for uuid_, name in self.AD.callbacks.get_event_callbacks(namespace, data['event_type']):
+                if name not in self.AD.callbacks.callbacks or uuid_ not in self.AD.callbacks.callbacks[name]:
+                    continue
+                callback = self.AD.callbacks.callbacks[name][uuid_]
+
+                # Check any filters
+
+                _run = True
+                for key in callback["kwargs"]:
+                    if key in data["data"] and callback["kwargs"][key] != \
+                            data["data"][key]:
+                        _run = False
+
+                if data["event_type"] == "__AD_LOG_EVENT":
+                    if "log" in callback["kwargs"] and callback["kwargs"]["log"] != data["data"]["log_type"]:
+                        _run = False
+
+
+                if _run:
+                    with self.AD.app_management.objects_lock:
+                        if name in self.AD.app_management.objects:
+                            await self.AD.threading.dispatch_worker(name, {
+                                "id": uuid_,
+                                "name": name,
+                                "objectid": self.AD.app_management.objects[name]["id"],
+                                "type": "event",
+                                "event": data['event_type'],
+                                "function": callback["function"],
+                                "data": data["data"],
+                                "pin_app": callback["pin_app"],
+                                "pin_thread": callback["pin_thread"],
+                                "kwargs": callback["kwargs"]
+                            })
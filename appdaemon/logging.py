@@ -66,12 +66,7 @@ class LogSubscriptionHandler(StreamHandler):
                 if record.name == "AppDaemon._stream":
                     has_log_callback = True
                 else:
-                    with self.AD.callbacks.callbacks_lock:
-                        for callback in self.AD.callbacks.callbacks:
-                            for uuid in self.AD.callbacks.callbacks[callback]:
-                                cb = self.AD.callbacks.callbacks[callback][uuid]
-                                if cb["name"] == record.appname and cb["type"] == "event" and cb["event"] == "__AD_LOG_EVENT":
-                                    has_log_callback = True
+                    has_log_callback = self.AD.callbacks.has_event_callback(record.appname, "__AD_LOG_EVENT")
 
                 if has_log_callback is False and self.AD.thread_async is not None:
                     self.AD.thread_async.call_async_no_wait(self.AD.events.process_event, "global", {"event_type": "__AD_LOG_EVENT",
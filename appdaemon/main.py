@@ -41,7 +41,8 @@ class ADMain():
             self.AD.app_management.dump_objects()
             self.AD.sched.dump_sun()
         if signum == signal.SIGHUP:
-            self.AD.app_management.check_app_updates(True)
+            # Off the loop, as the utility loop does, so apps' async initialize() and terminate() can run on it
+            self.AD.loop.run_in_executor(self.AD.executor, self.AD.app_management.check_app_updates, True)
         if signum == signal.SIGINT:
             self.logger.info("Keyboard interrupt")
             self.stop()
@@ -125,6 +126,7 @@ class ADMain():
         parser.add_argument("-s", "--starttime", help="start time for scheduler <YYYY-MM-DD HH:MM:SS>", type=str)
         parser.add_argument("-e", "--endtime", help="end time for scheduler <YYYY-MM-DD HH:MM:SS>", type=str, default=None)
         parser.add_argument("-i", "--interval", help="multiplier for scheduler tick", type=float, default=None)
+        parser.add_argument("-f", "--fastforward", help="skip idle ticks when time travelling", action='store_true')
         parser.add_argument("-D", "--debug", help="global debug level", default="INFO", choices=
                             [
                                 "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"
@@ -233,6 +235,9 @@ class ADMain():
         if "interval" not in appdaemon:
             appdaemon["interval"] = args.interval
 
+        if args.fastforward is True:
+            appdaemon["fast_forward"] = True
+
         appdaemon["loglevel"] = args.debug
 
         appdaemon["config_dir"] = os.path.dirname(config_file_yaml)
@@ -88,7 +88,11 @@ class DummyPlugin(PluginBase):
                 return None
             else:
                 event = self.config["sequence"]["events"][self.current_event]
-                await asyncio.sleep(event["offset"])
+                if self.AD.sched is not None:
+                    # Follows the scheduler's clock so sequences can be replayed when fast forwarding
+                    await self.AD.sched.sleep(event["offset"])
+                else:
+                    await asyncio.sleep(event["offset"])
                 if "state" in event:
                     entity = event["state"]["entity"]
                     old_state = self.state[entity]
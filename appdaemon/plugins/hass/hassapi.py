@@ -51,7 +51,7 @@ class Hass(adbase.ADBase, adapi.ADAPI):
     #
 
     def get_trackers(self, **kwargs):
-        return (key for key, value in self.get_state("device_tracker", **kwargs).items())
+        return (key for key in self.get_state("device_tracker", **kwargs))
 
     def get_tracker_details(self, **kwargs):
         return self.get_state("device_tracker", **kwargs)
@@ -61,30 +61,24 @@ class Hass(adbase.ADBase, adapi.ADAPI):
         return self.get_state(entity_id, **kwargs)
 
     def anyone_home(self, **kwargs):
-        state = self.get_state(**kwargs)
+        state = self.get_state("device_tracker", **kwargs)
         for entity_id in state.keys():
-            thisdevice, thisentity = entity_id.split(".")
-            if thisdevice == "device_tracker":
-                if state[entity_id]["state"] == "home":
-                    return True
+            if state[entity_id]["state"] == "home":
+                return True
         return False
 
     def everyone_home(self, **kwargs):
-        state = self.get_state(**kwargs)
+        state = self.get_state("device_tracker", **kwargs)
         for entity_id in state.keys():
-            thisdevice, thisentity = entity_id.split(".")
-            if thisdevice == "device_tracker":
-                if state[entity_id]["state"] != "home":
-                    return False
+            if state[entity_id]["state"] != "home":
+                return False
         return True
 
     def noone_home(self, **kwargs):
-        state = self.get_state(**kwargs)
+        state = self.get_state("device_tracker", **kwargs)
         for entity_id in state.keys():
-            thisdevice, thisentity = entity_id.split(".")
-            if thisdevice == "device_tracker":
-                if state[entity_id]["state"] == "home":
-                    return False
+            if state[entity_id]["state"] == "home":
+                return False
         return True
 
     #
@@ -10,6 +10,11 @@ import time
 import re
 import asyncio
 import logging
+import heapq
+import math
+import bisect
+import json
+import os
 from collections import OrderedDict
 
 import appdaemon.utils as utils
@@ -28,9 +33,45 @@ class Scheduler:
         self.schedule = {}
         self.schedule_lock = threading.RLock()
 
+        #
+        # Min-heap of (timestamp, sequence, name, handle) used to find due entries
+        # without scanning the whole schedule every tick. Cancelled entries are left
+        # in place and discarded when they reach the top of the heap.
+        #
+        self.schedule_heap = []
+        self.schedule_seq = 0
+        self.schedule_stale = 0
+
         self.sun = {}
         self.sun_lock = threading.RLock()
 
+        # Sun timers waiting for the next rise or set time, keyed on event type then handle
+        self.inactive_sun = {"next_rising": {}, "next_setting": {}}
+
+        # Timers read from the last snapshot waiting for their app to initialize
+        self.restore = {}
+        self.restore_lock = threading.RLock()
+        self.snapshot_file = None
+        # Handles of timers that can't be saved, so each is only reported once
+        self.unsaved = set()
+        if self.AD.config_dir is not None:
+            self.snapshot_file = os.path.join(self.AD.config_dir, "scheduler_snapshot.json")
+
+        # Timer lateness - per app and global histograms for dispatch and thread start
+        self.latency = {"dispatch": {}, "start": {}}
+        self.latency_lock = threading.Lock()
+        self.latency_dirty = set()
+        self.latency_entities = set()
+
+        # Compiled cron expressions keyed on expression and excluded dates
+        self.cron_cache = {}
+
+        # Precomputed sun events, rebuilt when they run out or the location changes
+        self.sun_table = {}
+        self.sun_table_start = None
+        self.sun_updated = None
+        self.location_key = None
+
         self.now = pytz.utc.localize(datetime.datetime.utcnow())
 
         #
@@ -43,10 +84,22 @@ class Scheduler:
         self.stopping = False
         self.realtime = True
 
+        #
+        # Used in event mode to wake the timer loop early when the schedule changes
+        #
+        self.wakeup = asyncio.Event()
+        self.next_wakeup = None
+
+        #
+        # Coroutines waiting for a point in virtual time when fast forwarding
+        #
+        self.sleepers = []
+        self.sleep_seq = 0
+
         tt = self.set_start_time()
 
         if self.AD.endtime is not None:
-            unaware_end = datetime.datetime.strptime(self.AD.starttime, "%Y-%m-%d %H:%M:%S")
+            unaware_end = datetime.datetime.strptime(self.AD.endtime, "%Y-%m-%d %H:%M:%S")
             aware_end = self.AD.tz.localize(unaware_end)
             self.endtime = aware_end.astimezone(pytz.utc)
         else:
@@ -77,6 +130,11 @@ class Scheduler:
 
         self.update_sun()
 
+        # Pick up any timers saved when we last stopped
+
+        if self.AD.persist_schedule is True and self.AD.apps is True:
+            self.load_snapshot()
+
     def set_start_time(self):
         tt = False
         if self.AD.starttime is not None:
@@ -96,12 +154,32 @@ class Scheduler:
     def stop(self):
         self.logger.debug("stop() called for scheduler")
         self.stopping = True
+        self.wake_scheduler()
+
+    def is_fast_forward(self):
+        return self.AD.fast_forward is True and self.realtime is False
+
+    def is_event_mode(self):
+        return self.AD.scheduler_mode == "event" and self.realtime is True
+
+    def wake_scheduler(self, timestamp=None):
+        # May be called from worker threads so hand off to the loop safely
+        if self.is_event_mode():
+            if timestamp is None or self.next_wakeup is None or timestamp.timestamp() < self.next_wakeup:
+                self.AD.loop.call_soon_threadsafe(self.wakeup.set)
 
     def cancel_timer(self, name, handle):
         self.logger.debug("Canceling timer for %s", name)
         with self.schedule_lock:
             if name in self.schedule and handle in self.schedule[name]:
+                timestamp = self.schedule[name][handle]["timestamp"]
+                self.discard_inactive_sun(self.schedule[name][handle]["type"], handle)
+                # Parked sun timers have no heap entry to discard
+                if "inactive" not in self.schedule[name][handle]:
+                    self.discard_heap_entries(1)
                 del self.schedule[name][handle]
+                if self.next_wakeup is not None and timestamp.timestamp() <= self.next_wakeup:
+                    self.wake_scheduler()
                 self.AD.thread_async.call_async_no_wait(self.AD.state.remove_entity, "admin", "scheduler_callback.{}".format(handle))
             if name in self.schedule and self.schedule[name] == {}:
                 del self.schedule[name]
@@ -112,6 +190,7 @@ class Scheduler:
             # Locking performed in calling function
             if "inactive" in args:
                 return
+            self.record_latency("dispatch", name, args["timestamp"])
             # Call function
             with self.AD.app_management.objects_lock:
                 if "__entity" in args["kwargs"]:
@@ -127,6 +206,7 @@ class Scheduler:
                         "old_state": args["kwargs"]["__old_state"],
                         "pin_app": args["pin_app"],
                         "pin_thread": args["pin_thread"],
+                        "timestamp": args["timestamp"],
                         "kwargs": args["kwargs"],
                     })
                 else:
@@ -138,6 +218,7 @@ class Scheduler:
                         "function": args["callback"],
                         "pin_app": args["pin_app"],
                         "pin_thread": args["pin_thread"],
+                        "timestamp": args["timestamp"],
                         "kwargs": args["kwargs"],
                     })
             # If it is a repeating entry, rewrite with new timestamp
@@ -148,16 +229,30 @@ class Scheduler:
                     # So we can adjust with a scan at sun rise/set
                     if args["offset"] < 0:
                         args["inactive"] = 1
+                        self.inactive_sun[args["type"]][entry] = name
                     else:
                         # We have a valid time for the next sunrise/set so use it
                         c_offset = self.get_offset(args)
                         args["timestamp"] = self.sun[args["type"]] + timedelta(seconds=c_offset)
                         args["offset"] = c_offset
+                        self.push_heap_entry(name, entry, args["timestamp"])
+                elif args["type"] == "cron":
+                    # Jump straight to the next matching time rather than firing and filtering
+                    args["basetime"] = self.get_next_cron(args["kwargs"], args["basetime"])
+                    args["timestamp"] = args["basetime"] + timedelta(seconds=self.get_offset(args))
+                    self.push_heap_entry(name, entry, args["timestamp"])
+                elif args["type"] == "daily":
+                    # Daily timers follow the wall clock, so step the local date rather than
+                    # adding a fixed number of seconds which would drift across DST changes
+                    args["basetime"] = self.localize(self.make_naive(args["basetime"]) + timedelta(seconds=args["interval"]))
+                    args["timestamp"] = args["basetime"] + timedelta(seconds=self.get_offset(args))
+                    self.push_heap_entry(name, entry, args["timestamp"])
                 else:
                     # Not sunrise or sunset so just increment
                     # the timestamp with the repeat interval
                     args["basetime"] += timedelta(seconds = args["interval"])
                     args["timestamp"] = args["basetime"] + timedelta(seconds=self.get_offset(args))
+                    self.push_heap_entry(name, entry, args["timestamp"])
                 # Update entity
 
                 await self.AD.state.set_state("_scheduler", "admin", "scheduler_callback.{}".format(entry), execution_time = utils.dt_to_str(args["timestamp"].replace(microsecond=0), self.AD.tz))
@@ -185,17 +280,36 @@ class Scheduler:
     def process_sun(self, action):
         self.logger.debug("Process sun: %s, next sunrise: %s, next sunset: %s", action, self.sun["next_rising"], self.sun["next_setting"])
         with self.schedule_lock:
-            for name in self.schedule.keys():
-                for entry in sorted(
-                        self.schedule[name].keys(),
-                        key=lambda uuid_: self.schedule[name][uuid_]["timestamp"]
-                ):
+            # Only the timers parked waiting for this event need to be looked at
+            inactive = self.inactive_sun[action]
+            self.inactive_sun[action] = {}
+            for entry, name in inactive.items():
+                if name not in self.schedule or entry not in self.schedule[name]:
+                    continue
+                schedule = self.schedule[name][entry]
+                if "inactive" in schedule:
+                    del schedule["inactive"]
+                    c_offset = self.get_offset(schedule)
+                    schedule["timestamp"] = self.sun[action] + timedelta(seconds=c_offset)
+                    schedule["offset"] = c_offset
+                    self.push_heap_entry(name, entry, schedule["timestamp"])
+
+    def process_dst(self):
+        #
+        # Fixed interval and sun based timers are held in UTC so are unaffected by DST.
+        # Daily and cron timers are pinned to the local wall clock, so make sure each one is
+        # localized for the date it will next run on.
+        #
+        with self.schedule_lock:
+            for name in self.schedule:
+                for entry in self.schedule[name]:
                     schedule = self.schedule[name][entry]
-                    if schedule["type"] == action and "inactive" in schedule:
-                        del schedule["inactive"]
-                        c_offset = self.get_offset(schedule)
-                        schedule["timestamp"] = self.sun[action] + timedelta(seconds=c_offset)
-                        schedule["offset"] = c_offset
+                    if (schedule["type"] == "daily" or schedule["type"] == "cron") and "inactive" not in schedule:
+                        basetime = self.localize(self.make_naive(schedule["basetime"]))
+                        if basetime != schedule["basetime"]:
+                            schedule["basetime"] = basetime
+                            schedule["timestamp"] = basetime + timedelta(seconds=schedule["offset"])
+                            self.push_heap_entry(name, entry, schedule["timestamp"])
 
     def init_sun(self):
         latitude = self.AD.latitude
@@ -212,32 +326,58 @@ class Scheduler:
         self.location = astral.Location((
             '', '', latitude, longitude, self.AD.tz.zone, elevation
         ))
+        self.location_key = (latitude, longitude, elevation, self.AD.tz.zone)
 
-    def update_sun(self):
+        self.build_sun_table()
 
-        mod = -1
-        while True:
+    def build_sun_table(self):
+        #
+        # Compute a rolling year of sunrise and sunset times so that update_sun()
+        # doesn't need to call astral every tick
+        #
+        start = (self.now - datetime.timedelta(days=1)).date()
+        table = {"next_rising": [], "next_setting": []}
+        for day in range(367):
+            date = start + datetime.timedelta(days=day)
             try:
-                next_rising_dt = self.location.sunrise(
-                    (self.now + datetime.timedelta(days=mod)).date(), local=False
-                )
-                if next_rising_dt > self.now:
-                    break
+                table["next_rising"].append(self.location.sunrise(date, local=False))
             except astral.AstralError:
                 pass
-            mod += 1
-
-        mod = -1
-        while True:
             try:
-                next_setting_dt = self.location.sunset(
-                    (self.now + datetime.timedelta(days=mod)).date(), local=False
-                )
-                if next_setting_dt > self.now:
-                    break
+                table["next_setting"].append(self.location.sunset(date, local=False))
             except astral.AstralError:
                 pass
-            mod += 1
+
+        with self.sun_lock:
+            self.sun_table = table
+            self.sun_table_start = start
+
+        self.logger.debug("Sun table built from %s, %s sunrises, %s sunsets", start, len(table["next_rising"]), len(table["next_setting"]))
+
+    def next_sun_event(self, event):
+        index = bisect.bisect_right(self.sun_table[event], self.now)
+        if index == len(self.sun_table[event]) or (self.now - datetime.timedelta(days=1)).date() < self.sun_table_start:
+            # Rolled off the end of the table, or the clock went backwards
+            self.build_sun_table()
+            index = bisect.bisect_right(self.sun_table[event], self.now)
+            if index == len(self.sun_table[event]):
+                raise ValueError("Unable to find next {} for current location".format(event))
+
+        return self.sun_table[event][index]
+
+    def update_sun(self):
+
+        location_key = (self.AD.latitude, self.AD.longitude, self.AD.elevation, self.AD.tz.zone)
+        if location_key != self.location_key:
+            self.logger.info("Location changed - recalculating sun events")
+            self.init_sun()
+        elif self.sun_updated is not None and self.sun_updated <= self.now < min(self.sun["next_rising"], self.sun["next_setting"]):
+            # Neither event has passed since we last looked
+            return
+
+        next_rising_dt = self.next_sun_event("next_rising")
+        next_setting_dt = self.next_sun_event("next_setting")
+        self.sun_updated = self.now
 
         with self.sun_lock:
             old_next_rising_dt = self.sun.get("next_rising")
@@ -279,9 +419,10 @@ class Scheduler:
         #aware_dt will include a timezone of some sort - convert to utc timezone
         utc = aware_dt.astimezone(pytz.utc)
 
-        # Round to nearest tick
+        # Round to nearest tick - not needed in event mode as the loop wakes exactly on time
 
-        utc = self.my_dt_round(utc, base=self.AD.tick)
+        if not self.is_event_mode():
+            utc = self.my_dt_round(utc, base=self.AD.tick)
 
         with self.AD.app_management.objects_lock:
             if "pin" in kwargs:
@@ -319,11 +460,15 @@ class Scheduler:
                     "kwargs": kwargs
                 }
 
+            self.push_heap_entry(name, handle, ts)
+
+        self.wake_scheduler(ts)
+
         self.AD.thread_async.call_async_no_wait(self.AD.state.add_entity, "admin", "scheduler_callback.{}".format(handle), "active",
                                                                          {
                                                                              "app": name,
                                                                              "execution_time": utils.dt_to_str(ts.replace(microsecond=0), self.AD.tz),
-                                                                             "repeat": str(datetime.timedelta(seconds=interval)),
+                                                                             "repeat": kwargs["cron"] if type_ == "cron" else str(datetime.timedelta(seconds=interval)),
                                                                              "function": callback.__name__,
                                                                              "pinned": pin_app,
                                                                              "pinned_thread": pin_thread,
@@ -339,9 +484,52 @@ class Scheduler:
         with self.schedule_lock:
             if name in self.schedule:
                 for id in self.schedule[name]:
+                    self.discard_inactive_sun(self.schedule[name][id]["type"], id)
                     self.AD.thread_async.call_async_no_wait(self.AD.state.remove_entity, "admin", "scheduler_callback.{}".format(id))
+                self.discard_heap_entries(len([entry for entry in self.schedule[name].values() if "inactive" not in entry]))
                 del self.schedule[name]
 
+        self.clear_latency(name)
+
+    #
+    # Heap and index maintenance - locking performed in calling function
+    #
+
+    def discard_inactive_sun(self, type_, handle):
+        if type_ in self.inactive_sun:
+            self.inactive_sun[type_].pop(handle, None)
+
+    def push_heap_entry(self, name, handle, timestamp):
+        self.schedule_seq += 1
+        heapq.heappush(self.schedule_heap, (timestamp, self.schedule_seq, name, handle))
+
+    def discard_heap_entries(self, count):
+        # Entries are removed lazily, but rebuild the heap if it is mostly dead weight
+        self.schedule_stale += count
+        if self.schedule_stale > 1000 and self.schedule_stale * 2 > len(self.schedule_heap):
+            self.rebuild_heap()
+
+    def rebuild_heap(self):
+        heap = []
+        for name in self.schedule:
+            for handle, entry in self.schedule[name].items():
+                if "inactive" not in entry:
+                    self.schedule_seq += 1
+                    heap.append((entry["timestamp"], self.schedule_seq, name, handle))
+        heapq.heapify(heap)
+        self.schedule_heap = heap
+        self.schedule_stale = 0
+
+    def pop_due_entries(self, utc):
+        due = []
+        while self.schedule_heap and self.schedule_heap[0][0] <= utc:
+            ts, seq, name, handle = heapq.heappop(self.schedule_heap)
+            if name in self.schedule and handle in self.schedule[name]:
+                due.append((name, handle))
+            elif self.schedule_stale > 0:
+                self.schedule_stale -= 1
+        return due
+
     def is_realtime(self):
         return self.realtime
 
@@ -356,6 +544,20 @@ class Scheduler:
 
         self.set_start_time()
 
+        if self.AD.fast_forward is True:
+            if self.realtime is False:
+                await self.do_every_fast_forward()
+                return
+            else:
+                self.logger.warning("fast_forward is only supported with time travel - ignoring")
+
+        if self.AD.scheduler_mode == "event":
+            if self.realtime is True:
+                await self.do_every_event()
+                return
+            else:
+                self.logger.warning("scheduler_mode 'event' is not supported with time travel - using tick mode")
+
         t = self.myround(self.get_now_ts(), base=self.AD.tick)
         count = 0
         t_ = self.myround(time.time(), base=self.AD.tick)
@@ -371,6 +573,108 @@ class Scheduler:
                 t_ = r.timestamp()
                 count = 0
 
+    async def do_every_fast_forward(self):
+        #
+        # Step the clock along the same grid as the tick loop, but skip straight to
+        # the next step at which something can happen rather than visiting every one
+        #
+        self.logger.info("Fast forwarding through time travel")
+        t = self.myround(self.get_now_ts(), base=self.AD.tick)
+        while not self.stopping:
+            await self.wait_for_quiet()
+            steps = 1
+            next_event = self.get_next_event_ts()
+            if self.AD.interval > 0 and next_event is not None and next_event > t + self.AD.interval:
+                steps = math.ceil((next_event - t) / self.AD.interval)
+            t = self.myround(t + steps * self.AD.interval, base=self.AD.tick)
+            utc = datetime.datetime.fromtimestamp(t, pytz.utc)
+            await self.do_every_tick(utc)
+            self.wake_sleepers(utc)
+
+    async def wait_for_quiet(self):
+        #
+        # Let callbacks fired by the last step, and anything they hand back to the loop,
+        # finish before moving the clock so that whatever they schedule is taken into account
+        #
+        # Always yield at least once, otherwise a step with nothing due never lets the rest of the loop run
+        await asyncio.sleep(0)
+        if self.AD.apps is not True:
+            return
+        while not self.stopping:
+            await utils.run_in_executor(self.AD.loop, self.AD.executor, self.AD.threading.wait_for_idle)
+            await self.AD.thread_async.join()
+            await self.AD.threading.wait_for_async_tasks()
+            if self.AD.threading.total_q_size() == 0 and not self.AD.threading.async_tasks:
+                break
+
+    def get_next_event_ts(self):
+        candidates = []
+        with self.schedule_lock:
+            if self.schedule_heap:
+                candidates.append(self.schedule_heap[0][0].timestamp())
+        with self.sun_lock:
+            for event in ("next_rising", "next_setting"):
+                candidates.append(self.sun[event].timestamp())
+        if self.sleepers:
+            candidates.append(self.sleepers[0][0])
+        dst_change = self.get_next_dst_change()
+        if dst_change is not None:
+            candidates.append(dst_change)
+        if self.endtime is not None:
+            candidates.append(self.endtime.timestamp())
+        return min(candidates)
+
+    def get_next_dst_change(self):
+        # pytz keeps the transition table on timezones that observe DST
+        transitions = getattr(self.AD.tz, "_utc_transition_times", None)
+        if transitions:
+            index = bisect.bisect_right(transitions, self.now.replace(tzinfo=None))
+            if index < len(transitions):
+                return pytz.utc.localize(transitions[index]).timestamp()
+        return None
+
+    async def sleep(self, delay):
+        # Sleep in scheduler time - used by plugins that replay events during time travel
+        if self.is_fast_forward():
+            future = self.AD.loop.create_future()
+            self.sleep_seq += 1
+            heapq.heappush(self.sleepers, (self.get_now_ts() + delay, self.sleep_seq, future))
+            await future
+        else:
+            await asyncio.sleep(delay)
+
+    def wake_sleepers(self, utc):
+        ts = utc.timestamp()
+        while self.sleepers and self.sleepers[0][0] <= ts:
+            wake, seq, future = heapq.heappop(self.sleepers)
+            if not future.done():
+                future.set_result(None)
+
+    async def do_every_event(self):
+        self.logger.info("Scheduler running in event mode")
+        while not self.stopping:
+            # Clear before calculating the wakeup so a change made in the meantime is not lost
+            self.wakeup.clear()
+            now = time.time()
+            self.next_wakeup = self.get_next_wakeup(now)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(self.next_wakeup - now, 0))
+            except asyncio.TimeoutError:
+                pass
+            if not self.stopping:
+                await self.do_every_tick(pytz.utc.localize(datetime.datetime.utcnow()))
+
+    def get_next_wakeup(self, now):
+        # Wake at least once a minute so DST changes and the end time are still noticed
+        next_wakeup = (math.floor(now / 60) + 1) * 60
+        with self.schedule_lock:
+            if self.schedule_heap:
+                next_wakeup = min(next_wakeup, self.schedule_heap[0][0].timestamp())
+        with self.sun_lock:
+            for event in ("next_rising", "next_setting"):
+                next_wakeup = min(next_wakeup, self.sun[event].timestamp())
+        return next_wakeup
+
 
     #
     # Scheduler Loop
@@ -385,7 +689,7 @@ class Scheduler:
 
             # If we have reached endtime bail out
 
-            if self.endtime is not None and self.now >= self.AD.endtime:
+            if self.endtime is not None and self.now >= self.endtime:
                 self.logger.info("End time reached, exiting")
                 if self.AD.stop_function is not None:
                     self.AD.stop_function()
@@ -406,30 +710,28 @@ class Scheduler:
 
             self.update_sun()
 
-            # Check if we have entered or exited DST - if so, reload apps
-            # to ensure all time callbacks are recalculated
+            # Check if we have entered or exited DST - if so, process_dst() re-localizes
+            # daily and cron timers so they still fire at the same local time
 
             now_dst = self.is_dst()
             if now_dst != self.was_dst:
-                self.logger.info("INFO", "Detected change in DST from %s to %s - reloading all modules", self.was_dst, now_dst)
-
-                self.logger.info("-" * 40)
-                await utils.run_in_executor(self.AD.loop, self.AD.executor, self.AD.app_management.check_app_updates, "__ALL__")
+                self.logger.info("Detected change in DST from %s to %s - recalculating daily timers", self.was_dst, now_dst)
+                self.process_dst()
             self.was_dst = now_dst
 
             # Process callbacks
 
             with self.schedule_lock:
-                for name in self.schedule.keys():
-                    for entry in sorted(
-                            self.schedule[name].keys(),
-                            key=lambda uuid_: self.schedule[name][uuid_]["timestamp"]
-                    ):
-
-                        if self.schedule[name][entry]["timestamp"] <= utc:
-                            await self.exec_schedule(name, entry, self.schedule[name][entry], entry)
-                        else:
-                            break
+                #
+                # Pop everything that is due before executing so that repeating entries
+                # rescheduled during this tick are not picked up again until the next one
+                #
+                for name, entry in self.pop_due_entries(utc):
+                    # A stale duplicate may refer to an entry that has already run this tick
+                    if name in self.schedule and entry in self.schedule[name]:
+                        args = self.schedule[name][entry]
+                        if "inactive" not in args and args["timestamp"] <= utc:
+                            await self.exec_schedule(name, entry, args, entry)
                 for k, v in list(self.schedule.items()):
                     if v == {}:
                         del self.schedule[k]
@@ -496,6 +798,8 @@ class Scheduler:
                         schedule[name][str(entry)]["interval"] = "sunrise:{}".format(utils.format_seconds(self.schedule[name][entry]["offset"]))
                     elif self.schedule[name][entry]["type"] == "next_setting":
                         schedule[name][str(entry)]["interval"] = "sunset:{}".format(utils.format_seconds(self.schedule[name][entry]["offset"]))
+                    elif self.schedule[name][entry]["type"] == "cron":
+                        schedule[name][str(entry)]["interval"] = "cron:{}".format(self.schedule[name][entry]["kwargs"]["cron"])
                     elif self.schedule[name][entry]["repeat"] is True:
                         schedule[name][str(entry)]["interval"] = utils.format_seconds(self.schedule[name][entry]["interval"])
                     else:
@@ -519,13 +823,16 @@ class Scheduler:
         return self.now.astimezone(self.AD.tz).dst() != datetime.timedelta(0)
 
     def get_now(self):
+        # In event mode the loop can sleep for up to a minute, so self.now may be well out of date
+        if self.is_event_mode():
+            return pytz.utc.localize(datetime.datetime.utcnow())
         return self.now
 
     def get_now_ts(self):
-        return self.now.timestamp()
+        return self.get_now().timestamp()
 
     def get_now_naive(self):
-        return self.make_naive(self.now)
+        return self.make_naive(self.get_now())
 
     def now_is_between(self, start_time_str, end_time_str, name=None):
         start_time = self._parse_time(start_time_str, name)["datetime"]
@@ -581,7 +888,7 @@ class Scheduler:
         else:
             parts = re.search('^(\d+):(\d+):(\d+)$', time_str)
             if parts:
-                today = self.now.astimezone(self.AD.tz)
+                today = self.get_now().astimezone(self.AD.tz)
                 time = datetime.time(
                     int(parts.group(1)), int(parts.group(2)), int(parts.group(3)), 0
                 )
@@ -644,6 +951,232 @@ class Scheduler:
                 raise ValueError("invalid time string: %s", time_str)
         return {"datetime": parsed_time, "sun": sun, "offset": offset}
 
+    #
+    # Persistence
+    #
+
+    def get_snapshot(self):
+        entries = []
+        unsaved = set()
+        with self.schedule_lock:
+            for name in self.schedule:
+                with self.AD.app_management.objects_lock:
+                    if name not in self.AD.app_management.objects:
+                        continue
+                    app = self.AD.app_management.objects[name]["object"]
+                for handle, entry in self.schedule[name].items():
+                    snapshot_entry = self.snapshot_entry(app, entry)
+                    if snapshot_entry is not None:
+                        entries.append(snapshot_entry)
+                    else:
+                        unsaved.add(handle)
+                        if handle not in self.unsaved:
+                            self.logger.warning("Unable to save timer %s() for %s - %s", self.get_callback_name(entry), name, self.snapshot_skip_reason(app, entry))
+            self.unsaved = unsaved
+
+        # Keep anything we haven't been able to restore yet
+
+        with self.restore_lock:
+            for name in self.restore:
+                entries.extend(self.restore[name])
+
+        return {"saved": utils.dt_to_str(self.now), "entries": entries}
+
+    @staticmethod
+    def get_callback_name(entry):
+        return getattr(entry["callback"], "__name__", repr(entry["callback"]))
+
+    @staticmethod
+    def snapshot_skip_reason(app, entry):
+        # Why snapshot_entry() can't save an entry, or None if it can
+        if getattr(entry["callback"], "__self__", None) is not app:
+            return "callback is not a method of the app"
+
+        if "__entity" in entry["kwargs"]:
+            return "duration timers for listen_state() are not saved"
+
+        try:
+            json.dumps({key: value for key, value in entry["kwargs"].items() if key != "__thread_id"})
+        except (TypeError, ValueError):
+            return "kwargs not serializable"
+
+        return None
+
+    def snapshot_entry(self, app, entry):
+        # We can only find bound methods of the app again after a restart, duration timers belong to a
+        # listen_state() callback that won't survive the restart, and kwargs have to fit in the JSON file
+        if self.snapshot_skip_reason(app, entry) is not None:
+            return None
+
+        callback = entry["callback"]
+        kwargs = {key: value for key, value in entry["kwargs"].items() if key != "__thread_id"}
+
+        return {
+            "app": entry["name"],
+            "callback": callback.__qualname__,
+            "function": callback.__name__,
+            "basetime": utils.dt_to_str(entry["basetime"]),
+            "timestamp": utils.dt_to_str(entry["timestamp"]),
+            "interval": entry["interval"],
+            "offset": entry["offset"],
+            "repeat": entry["repeat"],
+            "type": entry["type"],
+            "kwargs": kwargs
+        }
+
+    def save_snapshot(self, snapshot):
+        # Write to a temporary file and rename so a crash can't leave a partial snapshot
+        tmpfile = "{}.tmp".format(self.snapshot_file)
+        try:
+            with open(tmpfile, "w") as fh:
+                json.dump(snapshot, fh)
+            os.replace(tmpfile, self.snapshot_file)
+            self.logger.debug("Saved %s timers to %s", len(snapshot["entries"]), self.snapshot_file)
+        except:
+            self.logger.warning('-' * 60)
+            self.logger.warning("Unexpected error saving scheduler snapshot")
+            self.logger.warning('-' * 60)
+            self.logger.warning(traceback.format_exc())
+            self.logger.warning('-' * 60)
+
+    def load_snapshot(self):
+        if not os.path.isfile(self.snapshot_file):
+            return
+        try:
+            with open(self.snapshot_file, "r") as fh:
+                snapshot = json.load(fh)
+            with self.restore_lock:
+                for entry in snapshot["entries"]:
+                    self.restore.setdefault(entry["app"], []).append(entry)
+            self.logger.info("Read %s timers from scheduler snapshot", len(snapshot["entries"]))
+        except:
+            self.logger.warning('-' * 60)
+            self.logger.warning("Unexpected error reading scheduler snapshot - saved timers discarded")
+            self.logger.warning('-' * 60)
+            self.logger.warning(traceback.format_exc())
+            self.logger.warning('-' * 60)
+
+    def restore_app(self, name):
+        #
+        # Called once an app has initialized. Timers the app has already recreated in
+        # initialize() take precedence over the saved copies.
+        #
+        with self.restore_lock:
+            entries = self.restore.pop(name, [])
+
+        if not entries:
+            return
+
+        with self.AD.app_management.objects_lock:
+            if name not in self.AD.app_management.objects:
+                return
+            app = self.AD.app_management.objects[name]["object"]
+
+        existing = set()
+        with self.schedule_lock:
+            for entry in self.schedule.get(name, {}).values():
+                snapshot_entry = self.snapshot_entry(app, entry)
+                if snapshot_entry is not None:
+                    existing.add(self.snapshot_key(snapshot_entry))
+
+        restored = 0
+        for entry in entries:
+            if self.snapshot_key(entry) in existing:
+                continue
+            callback = getattr(app, entry["function"], None)
+            if callback is None or callback.__qualname__ != entry["callback"]:
+                self.logger.warning("Unable to restore timer %s() for %s - callback no longer exists", entry["function"], name)
+                continue
+            self.insert_schedule(name, self.get_restore_time(entry), callback, entry["repeat"], entry["type"], **entry["kwargs"])
+            restored += 1
+
+        if restored > 0:
+            self.logger.info("Restored %s timers for %s", restored, name)
+
+    @staticmethod
+    def snapshot_key(entry):
+        return entry["function"], entry["repeat"], entry["type"], entry["interval"], json.dumps(entry["kwargs"], sort_keys=True)
+
+    def get_restore_time(self, entry):
+        basetime = utils.str_to_dt(entry["basetime"])
+        if entry["repeat"] is False:
+            # Overdue one shot timers fire straight away
+            return basetime
+        if entry["type"] == "next_rising" or entry["type"] == "next_setting":
+            return self.sun[entry["type"]]
+        now = self.get_now()
+        if entry["type"] == "cron":
+            return self.get_next_cron(entry["kwargs"], now)
+        if entry["type"] == "daily":
+            while basetime < now:
+                basetime = self.localize(self.make_naive(basetime) + timedelta(seconds=entry["interval"]))
+        elif basetime < now and entry["interval"] > 0:
+            # Skip the runs we missed while we were down
+            missed = math.ceil((now - basetime).total_seconds() / entry["interval"])
+            basetime += timedelta(seconds=missed * entry["interval"])
+        return basetime
+
+    #
+    # Timer lateness
+    #
+
+    def record_latency(self, kind, name, timestamp):
+        # In time travel the scheduler clock is the only meaningful one
+        if self.realtime is True:
+            now = pytz.utc.localize(datetime.datetime.utcnow())
+        else:
+            now = self.now
+        delay = (now - timestamp).total_seconds()
+        with self.latency_lock:
+            for key in ("__global", name):
+                if key not in self.latency[kind]:
+                    self.latency[kind][key] = LatencyHistogram()
+                self.latency[kind][key].record(delay)
+                self.latency_dirty.add((kind, key))
+
+    async def update_latency_stats(self):
+        with self.latency_lock:
+            updates = {}
+            for kind, key in self.latency_dirty:
+                if key in self.latency[kind]:
+                    updates[(kind, key)] = self.latency[kind][key].get_stats()
+            self.latency_dirty = set()
+
+        for (kind, key), stats in updates.items():
+            if key == "__global":
+                entity = "sensor.scheduler_{}_delay".format(kind)
+            else:
+                entity = "sensor.scheduler_{}_delay_{}".format(kind, key)
+            if entity in self.latency_entities:
+                await self.AD.state.set_state("_scheduler", "admin", entity, state=stats["p95"], attributes=stats)
+            else:
+                self.latency_entities.add(entity)
+                await self.AD.state.add_entity("admin", entity, stats["p95"], stats)
+
+    def clear_latency(self, name):
+        with self.latency_lock:
+            for kind in self.latency:
+                self.latency[kind].pop(name, None)
+                entity = "sensor.scheduler_{}_delay_{}".format(kind, name)
+                if entity in self.latency_entities:
+                    self.latency_entities.remove(entity)
+                    self.AD.thread_async.call_async_no_wait(self.AD.state.remove_entity, "admin", entity)
+
+    #
+    # Cron
+    #
+
+    def get_cron(self, kwargs):
+        exclude = tuple(sorted(str(date) for date in kwargs.get("exclude_dates", [])))
+        key = (kwargs["cron"], exclude)
+        if key not in self.cron_cache:
+            self.cron_cache[key] = CronExpression(kwargs["cron"], exclude)
+        return self.cron_cache[key]
+
+    def get_next_cron(self, kwargs, aware_dt):
+        # Cron fields refer to local time so evaluate in the local timezone and convert back
+        return self.localize(self.get_cron(kwargs).get_next(self.make_naive(aware_dt)))
+
     #
     # Diagnostics
     #
@@ -710,6 +1243,181 @@ class Scheduler:
 
         return result
 
+    def localize(self, dt):
+        # Interpret a naive local time in the configured timezone and return it in UTC
+        return self.AD.tz.localize(dt).astimezone(pytz.utc)
+
     def make_naive(self, dt):
         local = dt.astimezone(self.AD.tz)
         return datetime.datetime(local.year, local.month, local.day,local.hour, local.minute, local.second, local.microsecond)
+
+
+class LatencyHistogram:
+
+    """
+    Fixed bucket histogram of timer lateness. Percentiles are reported as the upper
+    bound of the bucket they fall in, in milliseconds.
+    """
+
+    # Bucket upper bounds in seconds - anything later lands in a final overflow bucket
+    BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.max = 0
+
+    def record(self, delay):
+        delay = max(delay, 0)
+        self.counts[bisect.bisect_left(self.BUCKETS, delay)] += 1
+        self.count += 1
+        self.max = max(self.max, delay)
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0
+        target = math.ceil(self.count * p)
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total >= target:
+                if index < len(self.BUCKETS):
+                    return round(self.BUCKETS[index] * 1000)
+                break
+        return round(self.max * 1000)
+
+    def get_stats(self):
+        return {
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": round(self.max * 1000),
+            "count": self.count,
+            "unit_of_measurement": "ms"
+        }
+
+
+class CronExpression:
+
+    """
+    Compiled form of a cron expression - 5 fields (minute hour day month weekday) or
+    6 with a leading seconds field. Each field is expanded to a sorted list of the values
+    it matches so the next fire time can be found directly.
+    """
+
+    MACROS = {
+        "@yearly": "0 0 1 1 *",
+        "@annually": "0 0 1 1 *",
+        "@monthly": "0 0 1 * *",
+        "@weekly": "0 0 * * 0",
+        "@daily": "0 0 * * *",
+        "@midnight": "0 0 * * *",
+        "@hourly": "0 * * * *",
+    }
+
+    MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+    DAYS = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+
+    # Give up rather than loop forever on expressions that can never match, e.g. 30th February
+    MAX_DAYS = 366 * 5
+
+    def __init__(self, expression, exclude_dates=()):
+        self.expression = expression
+        fields = self.MACROS.get(expression.strip().lower(), expression).split()
+        if len(fields) == 5:
+            fields = ["0"] + fields
+        elif len(fields) != 6:
+            raise ValueError("Invalid cron expression '{}' - expected 5 or 6 fields".format(expression))
+
+        self.seconds = self.parse_field(fields[0], 0, 59)
+        self.minutes = self.parse_field(fields[1], 0, 59)
+        self.hours = self.parse_field(fields[2], 0, 23)
+        self.days = self.parse_field(fields[3], 1, 31)
+        self.months = self.parse_field(fields[4], 1, 12, self.MONTHS, 1)
+        # Cron weekdays count from Sunday = 0, allowing 7 for Sunday too
+        weekdays = self.parse_field(fields[5], 0, 7, self.DAYS, 0)
+        self.weekdays = sorted(set((day - 1) % 7 for day in weekdays))
+
+        # As with cron, if both day fields are restricted a day matching either will do
+        self.any_day = fields[3] == "*" or fields[3] == "?"
+        self.any_weekday = fields[5] == "*" or fields[5] == "?"
+
+        self.exclude_dates = set()
+        for date in exclude_dates:
+            if isinstance(date, str):
+                date = datetime.datetime.strptime(date, "%Y-%m-%d").date()
+            self.exclude_dates.add(date)
+
+    def parse_field(self, field, minimum, maximum, names=None, base=0):
+        values = set()
+        for part in field.lower().split(","):
+            step = 1
+            if "/" in part:
+                part, step = part.split("/", 1)
+                step = int(step)
+                if step < 1:
+                    raise ValueError("Invalid step in cron field '{}'".format(field))
+            if part == "*" or part == "?":
+                start, end = minimum, maximum
+            elif "-" in part:
+                start, end = [self.parse_value(value, names, base) for value in part.split("-", 1)]
+            else:
+                start = self.parse_value(part, names, base)
+                end = maximum if step > 1 else start
+            if start < minimum or end > maximum or start > end:
+                raise ValueError("Value out of range in cron field '{}'".format(field))
+            values.update(range(start, end + 1, step))
+        return sorted(values)
+
+    @staticmethod
+    def parse_value(value, names, base):
+        if names is not None and value[:3] in names:
+            return names.index(value[:3]) + base
+        return int(value)
+
+    def day_matches(self, date):
+        if date in self.exclude_dates or date.month not in self.months:
+            return False
+        day = date.day in self.days
+        weekday = date.weekday() in self.weekdays
+        if self.any_day:
+            return weekday
+        if self.any_weekday:
+            return day
+        return day or weekday
+
+    @staticmethod
+    def next_value(values, current):
+        index = bisect.bisect_left(values, current)
+        return values[index] if index < len(values) else None
+
+    def get_next(self, after):
+        #
+        # Find the first naive local time strictly after the one given that matches
+        #
+        candidate = after.replace(microsecond=0) + timedelta(seconds=1)
+        date = candidate.date()
+        hour, minute, second = candidate.hour, candidate.minute, candidate.second
+        for i in range(self.MAX_DAYS):
+            if self.day_matches(date):
+                next_hour = self.next_value(self.hours, hour)
+                while next_hour is not None:
+                    if next_hour != hour:
+                        minute = second = 0
+                    next_minute = self.next_value(self.minutes, minute)
+                    while next_minute is not None:
+                        if next_minute != minute:
+                            second = 0
+                        next_second = self.next_value(self.seconds, second)
+                        if next_second is not None:
+                            return datetime.datetime.combine(date, datetime.time(next_hour, next_minute, next_second))
+                        minute = next_minute + 1
+                        second = 0
+                        next_minute = self.next_value(self.minutes, minute)
+                    hour = next_hour + 1
+                    minute = second = 0
+                    next_hour = self.next_value(self.hours, hour)
+            date += timedelta(days=1)
+            hour = minute = second = 0
+
+        raise ValueError("Cron expression '{}' has no fire time in the next {} days".format(self.expression, self.MAX_DAYS))
@@ -17,9 +17,25 @@ class State:
         self.state = {}
         self.state["default"] = {}
         self.state["admin"] = {}
+        # state_lock only guards the set of namespaces - entities are guarded per namespace
+        # so that plugins and apps working in different namespaces don't contend
         self.state_lock = threading.RLock()
+        self.namespace_locks = {}
         self.logger = ad.logging.get_child("_state")
 
+        # Entries are replaced rather than modified in place, so a shallow copy of a namespace
+        # is a consistent snapshot - cache one per namespace until the namespace next changes
+        self.snapshots = {}
+
+        # Namespaces changed since they were last saved
+        self.dirty = set()
+
+        # Recent states of each entity for namespaces with history enabled - namespace -> entity -> buffer
+        self.history = {}
+
+        # Per namespace index of domain -> entity ids, built the first time a namespace is queried by domain
+        self.domains = {}
+
         # Initialize User Defined Namespaces
 
         nspath = os.path.join(self.AD.config_dir, "namespaces")
@@ -28,6 +44,12 @@ class State:
                 os.makedirs(nspath)
             for ns in self.AD.namespaces:
                 self.logger.info("User Defined Namespace '%s' initialized", ns)
+                if self.AD.namespaces[ns].get("backend", "json") == "sqlite":
+                    self.state[ns] = utils.SqliteDict(os.path.join(nspath, "{}.db".format(ns)),
+                                                      int(self.AD.namespaces[ns].get("cache_size", 1000)),
+                                                      int(self.AD.namespaces[ns].get("batch_size", 100)))
+                    continue
+
                 writeback = "safe"
                 if "writeback" in self.AD.namespaces[ns]:
                     writeback = self.AD.namespaces[ns]["writeback"]
@@ -36,7 +58,11 @@ class State:
                 if writeback == "safe":
                     safe = True
 
-                self.state[ns] = utils.PersistentDict(os.path.join(nspath, ns), safe)
+                fsync = "never"
+                if "fsync" in self.AD.namespaces[ns]:
+                    fsync = self.AD.namespaces[ns]["fsync"]
+
+                self.state[ns] = utils.PersistentDict(os.path.join(nspath, ns), safe, fsync)
         except:
                 self.logger.warning('-' * 60)
                 self.logger.warning("Unexpected error in namespace setup")
@@ -51,9 +77,16 @@ class State:
                 ns.append(namespace)
         return ns
 
+    def get_lock(self, namespace):
+        lock = self.namespace_locks.get(namespace)
+        if lock is None:
+            with self.state_lock:
+                lock = self.namespace_locks.setdefault(namespace, threading.RLock())
+        return lock
+
     def list_namespace_entities(self, namespace):
         et = []
-        with self.state_lock:
+        with self.get_lock(namespace):
             if namespace in self.state:
                 for entity in self.state[namespace]:
                     et.append(entity)
@@ -97,6 +130,7 @@ class State:
                         "pin_thread": pin_thread,
                         "kwargs": kwargs
                     }
+                self.AD.callbacks.add_state_index(name, handle, namespace, entity)
 
             #
             # In the case of a quick_start parameter,
@@ -104,9 +138,9 @@ class State:
             #
             if "immediate" in kwargs and kwargs["immediate"] is True:
                 if entity is not None and "new" in kwargs and "duration" in kwargs:
-                    with self.state_lock:
+                    with self.get_lock(namespace):
                         if self.state[namespace][entity]["state"] == kwargs["new"]:
-                            exec_time = self.AD.sched.get_now_ts() + int(kwargs["duration"])
+                            exec_time = self.AD.sched.get_now() + datetime.timedelta(seconds=int(kwargs["duration"]))
                             kwargs["__duration"] = self.AD.sched.insert_schedule(
                                 name, exec_time, cb, False, None,
                                 __entity=entity,
@@ -130,6 +164,7 @@ class State:
                 self.logger.warning("Invalid callback in cancel_state_callback() from app {}".format(name))
 
             if name in self.AD.callbacks.callbacks and handle in self.AD.callbacks.callbacks[name]:
+                self.AD.callbacks.remove_state_index(handle, self.AD.callbacks.callbacks[name][handle])
                 del self.AD.callbacks.callbacks[name][handle]
                 self.AD.thread_async.call_async_no_wait(self.AD.state.remove_entity, "admin",
                                                     "state_callback.{}".format(handle))
@@ -155,95 +190,62 @@ class State:
         data = state["data"]
         entity_id = data['entity_id']
         self.logger.debug(data)
-        device, entity = entity_id.split(".")
 
         # Process state callbacks
 
         removes = []
         with self.AD.callbacks.callbacks_lock:
-            for name in self.AD.callbacks.callbacks.keys():
-                for uuid_ in self.AD.callbacks.callbacks[name]:
-                    callback = self.AD.callbacks.callbacks[name][uuid_]
-                    if callback["type"] == "state" and (callback["namespace"] == namespace or callback[
-                        "namespace"] == "global" or namespace == "global"):
-                        cdevice = None
-                        centity = None
-                        if callback["entity"] is not None:
-                            if "." not in callback["entity"]:
-                                cdevice = callback["entity"]
-                                centity = None
-                            else:
-                                cdevice, centity = callback["entity"].split(".")
-                        if callback["kwargs"].get("attribute") is None:
-                            cattribute = "state"
-                        else:
-                            cattribute = callback["kwargs"].get("attribute")
-
-                        cold = callback["kwargs"].get("old")
-                        cnew = callback["kwargs"].get("new")
-
-                        executed = False
-                        if cdevice is None:
-                            executed = await self.AD.threading.check_and_dispatch_state(
-                                name, callback["function"], entity_id,
-                                cattribute,
-                                data['new_state'],
-                                data['old_state'],
-                                cold, cnew,
-                                callback["kwargs"],
-                                uuid_,
-                                callback["pin_app"],
-                                callback["pin_thread"]
-                            )
-                        elif centity is None:
-                            if device == cdevice:
-                                executed = await self.AD.threading.check_and_dispatch_state(
-                                    name, callback["function"], entity_id,
-                                    cattribute,
-                                    data['new_state'],
-                                    data['old_state'],
-                                    cold, cnew,
-                                    callback["kwargs"],
-                                    uuid_,
-                                    callback["pin_app"],
-                                    callback["pin_thread"]
-                                )
-
-                        elif device == cdevice and entity == centity:
-                            executed = await self.AD.threading.check_and_dispatch_state(
-                                name, callback["function"], entity_id,
-                                cattribute,
-                                data['new_state'],
-                                data['old_state'], cold,
-                                cnew,
-                                callback["kwargs"],
-                                uuid_,
-                                callback["pin_app"],
-                                callback["pin_thread"]
-                            )
-
-                        # Remove the callback if appropriate
-                        if executed is True:
-                            remove = callback["kwargs"].get("oneshot", False)
-                            if remove is True:
-                                removes.append({"name": callback["name"], "uuid": uuid_})
+            # The index only returns callbacks listening to this entity, its domain or everything
+            for uuid_, name in self.AD.callbacks.get_state_callbacks(namespace, entity_id):
+                if name not in self.AD.callbacks.callbacks or uuid_ not in self.AD.callbacks.callbacks[name]:
+                    continue
+                callback = self.AD.callbacks.callbacks[name][uuid_]
+                if callback["kwargs"].get("attribute") is None:
+                    cattribute = "state"
+                else:
+                    cattribute = callback["kwargs"].get("attribute")
+
+                cold = callback["kwargs"].get("old")
+                cnew = callback["kwargs"].get("new")
+
+                executed = await self.AD.threading.check_and_dispatch_state(
+                    name, callback["function"], entity_id,
+                    cattribute,
+                    data['new_state'],
+                    data['old_state'],
+                    cold, cnew,
+                    callback["kwargs"],
+                    uuid_,
+                    callback["pin_app"],
+                    callback["pin_thread"]
+                )
+
+                # Remove the callback if appropriate
+                if executed is True:
+                    remove = callback["kwargs"].get("oneshot", False)
+                    if remove is True:
+                        removes.append({"name": callback["name"], "uuid": uuid_})
 
             for remove in removes:
                 self.cancel_state_callback(remove["uuid"], remove["name"])
 
     def entity_exists(self, namespace, entity):
-        with self.state_lock:
+        with self.get_lock(namespace):
             if namespace in self.state and entity in self.state[namespace]:
                 return True
             else:
                 return False
 
     def get_entity(self, namespace = None, entity_id = None):
-        with self.state_lock:
-            if namespace is None:
-                return self.state
-            elif entity_id is None:
+        if namespace is None:
+            return {ns: self.get_entity(ns) for ns in self.get_namespaces()}
+
+        with self.get_lock(namespace):
+            if entity_id is None:
                 if namespace in self.state:
+                    # Database backed namespaces aren't dicts - hand out a copy that can be serialized
+                    if not isinstance(self.state[namespace], dict):
+                        return dict(self.state[namespace])
                     return self.state[namespace]
                 else:
                     self.logger.warning("Unknown namespace: %s", namespace)
@@ -264,30 +266,42 @@ class State:
         return namespaces
 
     async def remove_entity(self, namespace, entity):
-        with self.state_lock:
-            if entity in self.state[namespace]:
-                self.state[namespace].pop(entity)
-                data = \
+        with self.get_lock(namespace):
+            if entity not in self.state[namespace]:
+                return
+            self.state[namespace].pop(entity)
+            self.namespace_changed(namespace)
+            if namespace in self.history:
+                self.history[namespace].pop(entity, None)
+            if namespace in self.domains:
+                domain = entity.split(".", 1)[0]
+                if domain in self.domains[namespace]:
+                    self.domains[namespace][domain].discard(entity)
+
+        data = \
+            {
+                "event_type": "__AD_ENTITY_REMOVED",
+                "data":
                     {
-                        "event_type": "__AD_ENTITY_REMOVED",
-                        "data":
-                            {
-                                "entity_id": entity,
-                            }
+                        "entity_id": entity,
                     }
+            }
 
-                await self.AD.events.process_event(namespace, data)
+        await self.AD.events.process_event(namespace, data)
 
     async def add_entity(self, namespace, entity, state, attributes = None):
         if attributes is None:
             attrs = {}
         else:
-            attrs = attributes
+            attrs = utils.thaw_state(attributes)
 
         state = {"state": state, "last_changed": utils.dt_to_str(datetime.datetime(1970, 1, 1, 0, 0, 0, 0)), "attributes": attrs}
 
-        with self.state_lock:
+        with self.get_lock(namespace):
             self.state[namespace][entity] = state
+            self.namespace_changed(namespace)
+            self.index_entity(namespace, entity)
+            self.record_history(namespace, entity, state)
 
         data = \
             {
@@ -300,7 +314,7 @@ class State:
             }
         await self.AD.events.process_event(namespace, data)
 
-    def get_state(self, name, namespace, entity_id=None, attribute=None):
+    def get_state(self, name, namespace, entity_id=None, attribute=None, copy=None):
         self.logger.debug("get_state: %s.%s", entity_id, attribute)
         device = None
         entity = None
@@ -317,65 +331,134 @@ class State:
             else:
                 device, entity = entity_id.split(".")
 
-        with self.state_lock:
+        # Unless a copy is asked for, hand out read only views of the shared state
+        if copy is None:
+            copy = self.AD.state_copy
+        if copy is True:
+            result = deepcopy
+        else:
+            result = utils.freeze_state
+
+        with self.get_lock(namespace):
             if device is None:
-                return deepcopy(dict(self.state[namespace]))
+                if copy is True:
+                    return deepcopy(dict(self.state[namespace]))
+                return utils.StateView(self.get_snapshot(namespace))
             elif entity is None:
                 devices = {}
-                for entity_id in self.state[namespace].keys():
-                    thisdevice, thisentity = entity_id.split(".")
-                    if device == thisdevice:
-                        devices[entity_id] = self.state[namespace][entity_id]
-                return deepcopy(devices)
+                for entity_id in self.get_domain_entities(namespace, device):
+                    devices[entity_id] = self.state[namespace][entity_id]
+                return result(devices)
             elif attribute is None:
                 entity_id = "{}.{}".format(device, entity)
                 if entity_id in self.state[namespace] and "state" in self.state[namespace][entity_id]:
-                    return deepcopy(self.state[namespace][entity_id]["state"])
+                    return result(self.state[namespace][entity_id]["state"])
                 else:
                     return None
             else:
                 entity_id = "{}.{}".format(device, entity)
                 if attribute == "all":
                     if entity_id in self.state[namespace]:
-                        return deepcopy(self.state[namespace][entity_id])
+                        return result(self.state[namespace][entity_id])
                     else:
                         return None
                 else:
                     if namespace in self.state and entity_id in self.state[namespace]:
                         if attribute in self.state[namespace][entity_id]["attributes"]:
-                            return deepcopy(self.state[namespace][entity_id]["attributes"][
+                            return result(self.state[namespace][entity_id]["attributes"][
                                                 attribute])
                         elif attribute in self.state[namespace][entity_id]:
-                            return deepcopy(self.state[namespace][entity_id][attribute])
+                            return result(self.state[namespace][entity_id][attribute])
                         else:
                             return None
                     else:
                         return None
 
+    #
+    # Domain index - locking performed in calling function
+    #
+
+    def index_entity(self, namespace, entity_id):
+        if namespace in self.domains:
+            self.domains[namespace].setdefault(entity_id.split(".", 1)[0], set()).add(entity_id)
+
+    def get_domain_entities(self, namespace, domain):
+        if namespace not in self.domains:
+            domains = {}
+            for entity_id in self.state[namespace]:
+                domains.setdefault(entity_id.split(".", 1)[0], set()).add(entity_id)
+            self.domains[namespace] = domains
+        return sorted(self.domains[namespace].get(domain, ()))
+
+    def namespace_changed(self, namespace):
+        # Locking performed in calling function
+        self.snapshots.pop(namespace, None)
+        self.dirty.add(namespace)
+
+    #
+    # History - locking performed in calling function
+    #
+
+    def record_history(self, namespace, entity_id, state):
+        if namespace not in self.AD.history:
+            return
+        if namespace not in self.history:
+            self.history[namespace] = {}
+        buffer = self.history[namespace].get(entity_id)
+        if buffer is None:
+            config = self.AD.history[namespace] or {}
+            buffer = utils.HistoryBuffer(int(config.get("size", 100)), config.get("max_age"))
+            self.history[namespace][entity_id] = buffer
+        value = state.get("state") if isinstance(state, dict) else None
+        # Only record changes of state - attribute updates and repeated updates are skipped
+        if len(buffer) > 0 and buffer.last() == value:
+            return
+        buffer.append(self.AD.sched.get_now_ts() if self.AD.sched is not None else datetime.datetime.now().timestamp(), value)
+
+    def get_history(self, namespace, entity_id, since=None, limit=None):
+        with self.get_lock(namespace):
+            if namespace not in self.history or entity_id not in self.history[namespace]:
+                return []
+            now = self.AD.sched.get_now_ts()
+            if since is not None:
+                since = since.timestamp()
+            history = self.history[namespace][entity_id].get(since, limit, now)
+        return [(datetime.datetime.fromtimestamp(ts, self.AD.tz), value) for ts, value in history]
+
+    def get_snapshot(self, namespace):
+        # Locking performed in calling function
+        if namespace not in self.snapshots:
+            self.snapshots[namespace] = dict(self.state[namespace])
+        return self.snapshots[namespace]
+
     def parse_state(self, entity_id, namespace, **kwargs):
         self.logger.debug("parse_state: %s, %s", entity_id, kwargs)
 
         if entity_id in self.state[namespace]:
-            new_state = self.state[namespace][entity_id]
+            # Build a new entry - the current one may be shared with readers
+            new_state = dict(self.state[namespace][entity_id])
+            new_state["attributes"] = dict(new_state.get("attributes", {}))
         else:
             # Its a new state entry
             new_state = {}
             new_state["attributes"] = {}
 
+        # Values may be views handed out by get_state() - store plain data so it can be serialized
+
         if "state" in kwargs:
-            new_state["state"] = kwargs["state"]
+            new_state["state"] = utils.thaw_state(kwargs["state"])
             del kwargs["state"]
 
         if "attributes" in kwargs and kwargs.get('replace', False):
-            new_state["attributes"] = kwargs["attributes"]
+            new_state["attributes"] = utils.thaw_state(kwargs["attributes"])
         else:
             if "attributes" in kwargs:
-                new_state["attributes"].update(kwargs["attributes"])
+                new_state["attributes"].update(utils.thaw_state(kwargs["attributes"]))
             else:
                 if "replace" in kwargs:
                     del kwargs["replace"]
 
-                new_state["attributes"].update(kwargs)
+                new_state["attributes"].update(utils.thaw_state(kwargs))
 
         return new_state
 
@@ -386,62 +469,120 @@ class State:
             await self.set_state(name, namespace, entity_id, state=value)
 
     async def add_to_attr(self, name, namespace, entity_id, attr, i):
-        state = self.get_state(name, namespace, entity_id, attribute="all")
+        state = self.get_state(name, namespace, entity_id, attribute="all", copy=True)
         if state is not None:
             state["attributes"][attr] = copy(state["attributes"][attr]) + i
             await self.set_state(name, namespace, entity_id, attributes=state["attributes"])
 
     def set_state_simple(self, namespace, entity_id, state):
-        with self.state_lock:
+        with self.get_lock(namespace):
             self.state[namespace][entity_id] = state
+            self.namespace_changed(namespace)
+            self.index_entity(namespace, entity_id)
+            self.record_history(namespace, entity_id, state)
+
+    def set_states_simple(self, namespace, states):
+        # Apply a batch of updates under one lock, returning the state_changed events to fire
+        events = []
+        with self.get_lock(namespace):
+            for entity_id in states:
+                old_state = self.state[namespace].get(entity_id)
+                new_state = self.parse_state(entity_id, namespace, **states[entity_id])
+                self.set_state_simple(namespace, entity_id, new_state)
+                events.append(
+                    {
+                        "event_type": "state_changed",
+                        "data":
+                            {
+                                "entity_id": entity_id,
+                                "new_state": new_state,
+                                "old_state": old_state
+                            }
+                    })
+        return events
 
     async def set_state(self, name, namespace, entity_id, **kwargs):
         self.logger.debug("set_state(): %s, %s", entity_id, kwargs)
-        with self.state_lock:
-            old_state = deepcopy(self.state[namespace][entity_id])
+        with self.get_lock(namespace):
+            # parse_state() builds a new entry so the old one can be passed on as is
+            old_state = self.state[namespace].get(entity_id)
             new_state = self.parse_state(entity_id, namespace, **kwargs)
             new_state["last_changed"] = utils.dt_to_str(self.AD.sched.get_now().replace(microsecond=0), self.AD.tz)
             self.logger.debug("Old state: %s", old_state)
             self.logger.debug("New state: %s", new_state)
-            if not self.AD.state.entity_exists(namespace, entity_id):
+            if old_state is None:
                 self.logger.info("%s: Entity %s created in namespace: %s", name, entity_id, namespace)
 
-            data = \
-                        {
-                            "event_type": "state_changed",
-                            "data":
-                                {
-                                    "entity_id": entity_id,
-                                    "new_state": new_state,
-                                    "old_state": old_state
-                                }
-                        }
-            await self.AD.events.process_event(namespace, data)
+        # Don't hold the lock while callbacks are dispatched - the entry is stored by process_event()
+
+        data = \
+                    {
+                        "event_type": "state_changed",
+                        "data":
+                            {
+                                "entity_id": entity_id,
+                                "new_state": new_state,
+                                "old_state": old_state
+                            }
+                    }
+        await self.AD.events.process_event(namespace, data)
 
         return new_state
 
     def set_namespace_state(self, namespace, state):
-        with self.state_lock:
-            self.state[namespace] = state
+        with self.get_lock(namespace):
+            # Adding a namespace changes the set of namespaces, so take state_lock too
+            with self.state_lock:
+                self.state[namespace] = state
+            self.namespace_changed(namespace)
+            self.domains.pop(namespace, None)
+            if namespace in self.AD.history:
+                for entity_id in state:
+                    self.record_history(namespace, entity_id, state[entity_id])
 
     def update_namespace_state(self, namespace, state):
-        with self.state_lock:
+        with self.get_lock(namespace):
             self.state[namespace].update(state)
+            self.namespace_changed(namespace)
+            self.domains.pop(namespace, None)
 
     def save_namespace(self, namespace):
-        with self.state_lock:
+        with self.get_lock(namespace):
             self.state[namespace].save()
 
     def save_all_namespaces(self):
-        with self.state_lock:
-            for ns in self.AD.namespaces:
-                self.state[ns].save()
-
-    def save_hybrid_namespaces(self):
-        with self.state_lock:
-            for ns in self.AD.namespaces:
-                if self.AD.namespaces[ns]["writeback"] == "hybrid":
-                    self.state[ns].save()
+        for ns in self.AD.namespaces:
+            self.save_namespace(ns)
+
+    async def save_hybrid_namespaces(self):
+        #
+        # Take a snapshot of each changed namespace under the lock, then serialize and write
+        # it in the executor so event processing isn't held up by the disk
+        #
+        saves = []
+        for ns in self.AD.namespaces:
+            if ns not in self.dirty:
+                continue
+            with self.get_lock(ns):
+                if self.AD.namespaces[ns].get("backend") == "sqlite":
+                    # Database backed namespaces commit any partial batch here too
+                    saves.append((ns, self.state[ns].save, ()))
+                    self.dirty.discard(ns)
+                elif self.AD.namespaces[ns].get("writeback") == "hybrid":
+                    saves.append((ns, self.state[ns].write, (dict(self.state[ns]),)))
+                    self.dirty.discard(ns)
+
+        for ns, save, args in saves:
+            try:
+                await utils.run_in_executor(self.AD.loop, self.AD.executor, save, *args)
+            except:
+                # Leave it marked as changed so we try again next time around
+                self.dirty.add(ns)
+                self.logger.warning('-' * 60)
+                self.logger.warning("Unexpected error saving namespace %s", ns)
+                self.logger.warning('-' * 60)
+                self.logger.warning(traceback.format_exc())
+                self.logger.warning('-' * 60)
 
     #
     # Utilities
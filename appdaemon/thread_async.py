@@ -1,13 +1,18 @@
 import asyncio
+import collections
+import threading
+import time
 import traceback
 
 from appdaemon.appdaemon import AppDaemon
+from appdaemon.scheduler import LatencyHistogram
 
 
 class ThreadAsync:
 
     """
-    Module to translate from the thread world to the async world via queues
+    Module to translate from the thread world to the async world. Calls are queued from any thread
+    and the loop is woken with call_soon_threadsafe() to drain them in batches.
     """
 
     def __init__(self, ad: AppDaemon):
@@ -19,34 +24,101 @@ class ThreadAsync:
         # Initial Setup
         #
 
-        self.appq = asyncio.Queue(maxsize=0)
+        self.pending = collections.deque()
+        self.pending_lock = threading.Lock()
+        self.wakeup_pending = False
+        self.wakeup = asyncio.Event()
+        self.drained = asyncio.Event()
+        self.running = False
+
+        self.max_depth = 0
+        self.batches = 0
+        self.drain_latency = LatencyHistogram()
+        self.stats_entities = set()
 
     def stop(self):
         self.logger.debug("stop() called for thread_async")
         self.stopping = True
-        # Queue a fake event to make the loop wake up and exit
-        self.appq.put_nowait({"stop": True})
+        # Wake the loop up so it can exit
+        self.AD.loop.call_soon_threadsafe(self.wakeup.set)
 
     async def loop(self):
         while not self.stopping:
-            args = await self.appq.get()
-            if "stop" not in args:
-                self.logger.debug("thread_async loop, args=%s", args)
-                function = args["function"]
-                myargs = args["args"]
-                mykwargs = args["kwargs"]
-                try:
-                    result = await function(*myargs, **mykwargs)
-                except:
-                    self.logger.warning('-' * 60)
-                    self.logger.warning("Unexpected error during thread_async() loop()")
-                    self.logger.warning("args: %s", args)
-                    self.logger.warning('-' * 60)
-                    self.logger.warning(traceback.format_exc())
-                    self.logger.warning('-' * 60)
-
-            self.logger.debug("calling task_done()")
-            self.appq.task_done()
+            await self.wakeup.wait()
+            self.wakeup.clear()
+
+            with self.pending_lock:
+                batch = list(self.pending)
+                self.pending.clear()
+                self.wakeup_pending = False
+
+            if batch:
+                self.running = True
+                self.batches += 1
+                self.max_depth = max(self.max_depth, len(batch))
+                self.drain_latency.record(time.monotonic() - batch[0]["queued"])
+                await asyncio.gather(*[self.run_lane(lane) for lane in self.get_lanes(batch)])
+                self.running = False
+
+            self.drained.set()
+
+    @staticmethod
+    def get_lanes(batch):
+        #
+        # Calls against the same object (state, events, threading etc.) stay in the order they were queued,
+        # so an add_entity() can't overtake the remove_entity() queued after it. Separate objects are independent
+        # and run concurrently.
+        #
+        lanes = {}
+        for args in batch:
+            key = getattr(args["function"], "__self__", args["function"])
+            lanes.setdefault(id(key), []).append(args)
+        return lanes.values()
+
+    async def run_lane(self, lane):
+        for args in lane:
+            self.logger.debug("thread_async loop, args=%s", args)
+            try:
+                await args["function"](*args["args"], **args["kwargs"])
+            except:
+                self.logger.warning('-' * 60)
+                self.logger.warning("Unexpected error during thread_async() loop()")
+                self.logger.warning("args: %s", args)
+                self.logger.warning('-' * 60)
+                self.logger.warning(traceback.format_exc())
+                self.logger.warning('-' * 60)
+
+    async def join(self):
+        # Wait until everything queued so far has been run
+        while self.pending or self.running:
+            self.drained.clear()
+            await self.drained.wait()
 
     def call_async_no_wait(self, function, *args, **kwargs):
-        self.appq.put_nowait({"function": function, "args": args, "kwargs": kwargs})
+        # Safe to call from any thread - only the first call of a batch needs to wake the loop
+        with self.pending_lock:
+            self.pending.append({"function": function, "args": args, "kwargs": kwargs, "queued": time.monotonic()})
+            wakeup = not self.wakeup_pending
+            self.wakeup_pending = True
+        if wakeup:
+            self.AD.loop.call_soon_threadsafe(self.wakeup.set)
+
+    #
+    # Stats
+    #
+
+    async def update_stats(self):
+        depth = len(self.pending)
+        latency = self.drain_latency.get_stats()
+        updates = {
+            "sensor.thread_async_queue_depth": (depth, {"max": self.max_depth, "batches": self.batches}),
+            "sensor.thread_async_drain_latency": (latency["p95"], latency),
+        }
+        self.max_depth = depth
+
+        for entity, (state, attributes) in updates.items():
+            if entity in self.stats_entities:
+                await self.AD.state.set_state("_thread_async", "admin", entity, state=state, attributes=attributes)
+            else:
+                self.stats_entities.add(entity)
+                await self.AD.state.add_entity("admin", entity, state, attributes)
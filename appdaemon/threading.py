@@ -1,4 +1,5 @@
 import threading
+import asyncio
 import datetime
 from queue import Queue
 from random import randint
@@ -6,6 +7,7 @@ import re
 import sys
 import traceback
 import inspect
+import time
 from datetime import timedelta
 import logging
 import functools
@@ -46,14 +48,50 @@ class Threading:
         self.last_stats_time = datetime.datetime(1970, 1, 1, 0, 0, 0, 0)
         self.callback_list = []
 
+        # Thread, app and callback stats are kept in memory and only materialized
+        # into the admin namespace every admin_stats_interval by flush_admin_stats()
+
+        self.stats_lock = threading.Lock()
+        self.current_busy = 0
+        self.max_busy = 0
+        self.max_busy_time = None
+        self.last_action_time = None
+        self.busy_dirty = False
+        self.thread_stats = {}
+        self.dirty_threads = set()
+        self.app_stats = {}
+        self.dirty_apps = set()
+        self.total_deltas = {"fired": 0, "executed": 0}
+        self.callback_deltas = {}
+
+        # Native async callbacks run as tasks on the loop, limited per app
+
+        self.async_semaphores = {}
+        self.async_tasks = set()
+        self.app_tasks = {}
+
+        # Autoscaling of unpinned threads
+
+        self.autoscale_threads = False
+        self.autoscale_qsize = 5
+        self.autoscale_wait = 1
+        self.autoscale_cooldown = 300
+        self.min_threads = 0
+        self.max_threads = 0
+        self.max_wait = 0
+        self.scale_up_pending = False
+
     async def get_callback_update(self):
         now = datetime.datetime.now()
-        self.callback_list.append(
-            {
-                "fired": self.current_callbacks_fired,
-                "executed": self.current_callbacks_executed,
-                "ts": now
-            })
+        with self.stats_lock:
+            self.callback_list.append(
+                {
+                    "fired": self.current_callbacks_fired,
+                    "executed": self.current_callbacks_executed,
+                    "ts": now
+                })
+            self.current_callbacks_executed = 0
+            self.current_callbacks_fired = 0
 
         if len(self.callback_list) > 10:
             self.callback_list.pop(0)
@@ -77,8 +115,63 @@ class Threading:
         await self.set_state("_threading", "admin", "sensor.callbacks_average_executed", state=executed_avg)
 
         self.last_stats_time = now
-        self.current_callbacks_executed = 0
-        self.current_callbacks_fired = 0
+
+    async def flush_admin_stats(self):
+        with self.stats_lock:
+            totals = self.total_deltas
+            self.total_deltas = {"fired": 0, "executed": 0}
+            callbacks = self.callback_deltas
+            self.callback_deltas = {}
+            threads = {thread_id: dict(self.thread_stats[thread_id]) for thread_id in self.dirty_threads}
+            self.dirty_threads = set()
+            apps = {app: dict(self.app_stats[app]) for app in self.dirty_apps}
+            self.dirty_apps = set()
+            for app in apps:
+                self.app_stats[app]["callbacks"] = 0
+            busy = None
+            if self.busy_dirty is True:
+                busy = (self.current_busy, self.max_busy, self.max_busy_time, self.last_action_time)
+                self.busy_dirty = False
+
+        if totals["fired"] != 0:
+            await self.add_to_state("_threading", "admin", "sensor.callbacks_total_fired", totals["fired"])
+        if totals["executed"] != 0:
+            await self.add_to_state("_threading", "admin", "sensor.callbacks_total_executed", totals["executed"])
+
+        if busy is not None:
+            current_busy, max_busy, max_busy_time, last_action_time = busy
+            await self.set_state("_threading", "admin", "sensor.threads_current_busy", state=current_busy)
+            await self.set_state("_threading", "admin", "sensor.threads_max_busy", state=max_busy)
+            if max_busy_time is not None:
+                await self.set_state("_threading", "admin", "sensor.threads_max_busy_time", state=utils.dt_to_str(max_busy_time.replace(microsecond=0), self.AD.tz))
+            if last_action_time is not None:
+                await self.set_state("_threading", "admin", "sensor.threads_last_action_time", state=utils.dt_to_str(last_action_time.replace(microsecond=0), self.AD.tz))
+
+        for thread_id, info in threads.items():
+            await self.set_state("_threading", "admin", "thread.{}".format(thread_id),
+                                 q=self.threads[thread_id]["queue"].qsize(),
+                                 state=info["callback"],
+                                 time_called=utils.dt_to_str(info["time_called"].replace(microsecond=0), self.AD.tz),
+                                 is_alive=self.threads[thread_id]["thread"].is_alive(),
+                                 pinned_apps=self.get_pinned_apps(thread_id)
+                                 )
+
+        for app, info in apps.items():
+            await self.set_state("_threading", "admin", "app.{}".format(app), state=info["callback"])
+            if info["callbacks"] != 0:
+                await self.add_to_attr("_threading", "admin", "app.{}".format(app), "callbacks", info["callbacks"])
+
+        for entity, counts in callbacks.items():
+            for attr, value in counts.items():
+                if value != 0:
+                    await self.add_to_attr("_threading", "admin", entity, attr, value)
+
+    def add_callback_stat(self, type, uuid, attr):
+        # Locking performed in calling function
+        entity = "{}_callback.{}".format(type, uuid)
+        if entity not in self.callback_deltas:
+            self.callback_deltas[entity] = {"fired": 0, "executed": 0}
+        self.callback_deltas[entity][attr] += 1
 
     async def init_admin_stats(self):
 
@@ -126,6 +219,29 @@ class Threading:
         if self.pin_threads < 0:
             raise ValueError("pin_threads cannot be < 0")
 
+        utils.process_arg(self, "autoscale_threads", kwargs)
+        if self.autoscale_threads is True:
+            if self.auto_pin is True:
+                self.logger.warning("autoscale_threads needs pin_threads or total_threads to be set so there are unpinned threads - disabling")
+                self.autoscale_threads = False
+            else:
+                self.min_threads = self.total_threads
+                utils.process_arg(self, "min_threads", kwargs, int=True)
+                self.max_threads = self.min_threads * 2
+                utils.process_arg(self, "max_threads", kwargs, int=True)
+                utils.process_arg(self, "autoscale_qsize", kwargs, int=True)
+                utils.process_arg(self, "autoscale_wait", kwargs, float=True)
+                utils.process_arg(self, "autoscale_cooldown", kwargs, float=True)
+
+                if self.min_threads <= self.pin_threads:
+                    raise ValueError("min_threads must be > pin_threads")
+
+                if self.max_threads < self.min_threads:
+                    raise ValueError("max_threads cannot be < min_threads")
+
+                self.total_threads = self.min_threads
+                self.logger.info("Autoscaling unpinned threads between %s and %s workers", self.min_threads, self.max_threads)
+
         self.logger.info("Starting Apps with %s workers and %s pins", self.total_threads, self.pin_threads)
 
         self.next_thread = self.pin_threads
@@ -152,39 +268,48 @@ class Threading:
             qsize += self.threads[thread]["queue"].qsize()
         return qsize
 
+    def wait_for_idle(self):
+        # Blocks until every callback queued so far has completed
+        for thread in list(self.threads):
+            # The thread may have been retired since the snapshot was taken
+            info = self.threads.get(thread)
+            if info is not None:
+                info["queue"].join()
+
     def min_q_id(self):
         id = 0
-        i = 0
         qsize = sys.maxsize
-        for thread in self.threads:
-            if self.threads[thread]["queue"].qsize() < qsize:
-                qsize = self.threads[thread]["queue"].qsize()
-                id = i
-            i += 1
+        # Thread numbers have gaps once autoscaling retires threads, so use the number in the name
+        for thread, info in list(self.threads.items()):
+            if info["queue"].qsize() < qsize:
+                qsize = info["queue"].qsize()
+                id = int(thread.split("-")[1])
         return id
 
     def dump_threads(self):
         self.diag.info("--------------------------------------------------")
         self.diag.info("Threads")
         self.diag.info("--------------------------------------------------")
-        current_busy = self.get_state("_threading", "admin", "sensor.threads_current_busy")
-        max_busy = self.get_state("_threading", "admin", "sensor.threads_max_busy")
-        max_busy_time = utils.str_to_dt(self.get_state("_threading", "admin", "sensor.threads_max_busy_time"))
-        last_action_time = utils.str_to_dt(self.get_state("_threading", "admin", "sensor.threads_last_action_time"))
+        with self.stats_lock:
+            current_busy = self.current_busy
+            max_busy = self.max_busy
+            max_busy_time = self.max_busy_time
+            last_action_time = self.last_action_time
+            thread_stats = {thread: dict(self.thread_stats[thread]) for thread in self.thread_stats}
         self.diag.info("Currently busy threads: %s", current_busy)
         self.diag.info("Most used threads: %s at %s", max_busy, max_busy_time)
         self.diag.info("Last activity: %s", last_action_time)
         self.diag.info("Total Q Entries: %s", self.total_q_size())
         self.diag.info("--------------------------------------------------")
         for thread in sorted(self.threads, key=self.natural_keys):
-            t = self.get_state("_threading", "admin", "thread.{}".format(thread), attributes = all)
+            t = thread_stats[thread]
             self.diag.info(
                      "%s - qsize: %s | current callback: %s | since %s, | alive: %s, | pinned apps: %s",
                          thread,
-                         t["qsize"],
+                         self.threads[thread]["queue"].qsize(),
                          t["callback"],
                          t["time_called"],
-                         t["is_alive"],
+                         self.threads[thread]["thread"].is_alive(),
                          self.get_pinned_apps(thread)
                      )
         self.diag.info("--------------------------------------------------")
@@ -230,6 +355,7 @@ class Threading:
         id = "thread-{}".format(thread)
         q = self.threads[id]["queue"]
 
+        args["queued"] = time.monotonic()
         q.put_nowait(args)
 
     def check_overdue_and_dead_threads(self):
@@ -241,14 +367,64 @@ class Threading:
                     self.logger.critical("Thread will be restarted")
                     id=thread_id.split("-")[1]
                     self.add_thread(silent=False, pinthread=False, id=id)
-                if self.get_state("_threading", "admin", "thread.{}".format(thread_id)) != "idle":
-                    start = utils.str_to_dt(self.get_state("_threading", "admin", "thread.{}".format(thread_id), attribute="time_called"))
-                    dur = (self.AD.sched.get_now() - start).total_seconds()
-                    if dur >= self.AD.thread_duration_warning_threshold and dur % self.AD.thread_duration_warning_threshold == 0:
-                        self.logger.warning("Excessive time spent in callback: %s - %s",
-                                            self.get_state("_threading", "admin", "thread.{}".format(thread_id),
-                                                           attribute="callback")
-                                            , dur)
+                with self.stats_lock:
+                    info = self.thread_stats[thread_id]
+                    callback = info["callback"]
+                    dur = (self.AD.sched.get_now() - info["time_called"]).total_seconds()
+                    # Warn once each time another multiple of the threshold has passed
+                    multiple = int(dur // self.AD.thread_duration_warning_threshold)
+                    warn = callback != "idle" and multiple > info.get("warned", 0)
+                    if warn:
+                        info["warned"] = multiple
+                if warn:
+                    self.logger.warning("Excessive time spent in callback: %s - %s", callback, int(dur))
+
+    async def check_autoscale(self):
+        #
+        # Add an unpinned thread when the queues or the time callbacks wait for a thread stay above
+        # their thresholds for two checks in a row, and retire the last thread once it has been idle for the cooldown
+        #
+        unpinned = ["thread-{}".format(thread) for thread in range(self.pin_threads, self.thread_count)]
+        qsize = sum(self.threads[thread]["queue"].qsize() for thread in unpinned)
+        with self.stats_lock:
+            max_wait = self.max_wait
+            self.max_wait = 0
+
+        if qsize > self.autoscale_qsize or max_wait > self.autoscale_wait:
+            if self.scale_up_pending is True and self.thread_count < self.max_threads:
+                self.logger.info("Queue size is %s and callbacks waited up to %ss for a thread - adding a thread", qsize, round(max_wait, 3))
+                await self.add_thread(True)
+                # Count the cooldown from now rather than from the seed time, so a new thread isn't retired straight away
+                with self.stats_lock:
+                    self.thread_stats["thread-{}".format(self.thread_count - 1)]["time_called"] = self.AD.sched.get_now()
+            self.scale_up_pending = True
+            return
+
+        self.scale_up_pending = False
+
+        if self.thread_count <= self.min_threads:
+            return
+
+        thread = "thread-{}".format(self.thread_count - 1)
+        if self.threads[thread]["queue"].qsize() != 0 or self.get_pinned_apps(thread):
+            return
+        with self.stats_lock:
+            info = dict(self.thread_stats[thread])
+        if info["callback"] == "idle" and (self.AD.sched.get_now() - info["time_called"]).total_seconds() >= self.autoscale_cooldown:
+            await self.retire_thread(thread)
+
+    async def retire_thread(self, thread):
+        self.logger.info("Retiring idle thread %s", thread.split("-")[1])
+        # Take it out of the rotation first so nothing more is queued to it
+        self.thread_count -= 1
+        if self.next_thread >= self.thread_count:
+            self.next_thread = self.pin_threads
+        q = self.threads.pop(thread)["queue"]
+        with self.stats_lock:
+            self.thread_stats.pop(thread, None)
+            self.dirty_threads.discard(thread)
+        q.put_nowait(None)
+        await self.AD.state.remove_entity("admin", "thread.{}".format(thread))
 
     def check_q_size(self, warning_step, warning_iterations):
         if self.total_q_size() > self.AD.qsize_warning_threshold:
@@ -266,7 +442,7 @@ class Threading:
 
         return warning_step, warning_iterations
 
-    async def update_thread_info(self, thread_id, callback, app, type, uuid):
+    def update_thread_info(self, thread_id, callback, app, type, uuid):
         self.logger.debug("Update thread info: %s", thread_id)
         if self.AD.log_thread_actions:
             if callback == "idle":
@@ -276,39 +452,40 @@ class Threading:
                 self.diag.info(
                          "%s calling %s callback %s", thread_id, type, callback)
 
-        now = self.AD.sched.get_now()
-        if callback == "idle":
-            start = utils.str_to_dt(self.get_state("_threading", "admin", "thread.{}".format(thread_id), attribute="time_called"))
-            if self.AD.sched.realtime is True and (now - start).total_seconds() >= self.AD.thread_duration_warning_threshold:
-                self.logger.warning("callback %s has now completed", self.get_state("_threading", "admin", "thread.{}".format(thread_id)))
-            await self.add_to_state("_threading", "admin", "sensor.threads_current_busy", -1)
-            await self.add_to_attr("_threading", "admin", "app.{}".format(app), "callbacks", 1)
-            await self.add_to_attr("_threading", "admin", "{}_callback.{}".format(type, uuid), "executed", 1)
-            await self.add_to_state("_threading", "admin", "sensor.callbacks_total_executed", 1)
-            self.current_callbacks_executed += 1
-        else:
-            await self.add_to_state("_threading", "admin", "sensor.threads_current_busy", 1)
-            self.current_callbacks_fired += 1
-
-
-        current_busy = self.get_state("_threading", "admin", "sensor.threads_current_busy")
-        max_busy = self.get_state("_threading", "admin", "sensor.threads_max_busy")
-        if current_busy > max_busy:
-            await self.set_state("_threading", "admin", "sensor.threads_max_busy" , state=current_busy)
-            await self.set_state("_threading", "admin", "sensor.threads_max_busy_time", state=utils.dt_to_str(self.AD.sched.get_now().replace(microsecond=0), self.AD.tz))
-
-            await self.set_state("_threading", "admin", "sensor.threads_last_action_time", state=utils.dt_to_str(self.AD.sched.get_now().replace(microsecond=0), self.AD.tz))
+        # thread_id is None for async callbacks, which don't occupy a thread
 
-        # Update thread info
-
-        await self.set_state("_threading", "admin", "thread.{}".format(thread_id),
-                             q=self.threads[thread_id]["queue"].qsize(),
-                             state=callback,
-                             time_called=utils.dt_to_str(now.replace(microsecond=0), self.AD.tz),
-                             is_alive = self.threads[thread_id]["thread"].is_alive(),
-                             pinned_apps=self.get_pinned_apps(thread_id)
-                             )
-        await self.set_state("_threading", "admin", "app.{}".format(app), state=callback)
+        now = self.AD.sched.get_now()
+        with self.stats_lock:
+            if callback == "idle":
+                if thread_id is not None:
+                    info = self.thread_stats[thread_id]
+                    if info["callback"] != "idle" and self.AD.sched.realtime is True and (now - info["time_called"]).total_seconds() >= self.AD.thread_duration_warning_threshold:
+                        self.logger.warning("callback %s has now completed", info["callback"])
+                    self.current_busy -= 1
+                self.total_deltas["executed"] += 1
+                self.add_callback_stat(type, uuid, "executed")
+                self.current_callbacks_executed += 1
+            else:
+                if thread_id is not None:
+                    self.current_busy += 1
+                self.current_callbacks_fired += 1
+
+            if self.current_busy > self.max_busy:
+                self.max_busy = self.current_busy
+                self.max_busy_time = now
+            self.last_action_time = now
+            self.busy_dirty = True
+
+            if thread_id is not None:
+                self.thread_stats[thread_id] = {"callback": callback, "time_called": now}
+                self.dirty_threads.add(thread_id)
+
+            if app not in self.app_stats:
+                self.app_stats[app] = {"callback": callback, "callbacks": 0}
+            self.app_stats[app]["callback"] = callback
+            if callback == "idle":
+                self.app_stats[app]["callbacks"] += 1
+            self.dirty_apps.add(app)
 
     #
     # Pinning
@@ -325,6 +502,9 @@ class Threading:
         t.daemon = True
         name = "thread-{}".format(tid)
         t.setName(name)
+        with self.stats_lock:
+            # Aware, as it is compared against the scheduler's time
+            self.thread_stats[name] = {"callback": "idle", "time_called": datetime.datetime(1970, 1, 1, 0, 0, 0, 0, tzinfo=datetime.timezone.utc)}
         if id is None:
             await self.add_entity("admin", "thread.{}".format(name), "idle",
                                  {
@@ -554,18 +734,19 @@ class Threading:
             #
             # It's going to happen
             #
-            self.AD.thread_async.call_async_no_wait(self.add_to_state, "_threading", "admin",
-                                                    "sensor.callbacks_total_fired", 1)
-            #utils.run_coroutine_threadsafe(functools.partial(
-            #    self.add_to_state, "_threading", "admin", "sensor.callbacks_total_fired", 1
-            #), self.AD.loop)
-
-            self.AD.thread_async.call_async_no_wait(self.add_to_attr, "_threading", "admin",
-                                                    "{}_callback.{}".format(args["type"], args["id"]), "fired", 1)
+            with self.stats_lock:
+                self.total_deltas["fired"] += 1
+                self.add_callback_stat(args["type"], args["id"], "fired")
             #
-            # And Q
+            # And Q, or run directly on the loop for async callbacks
             #
-            self.select_q(args)
+            if asyncio.iscoroutinefunction(args["function"]):
+                task = self.AD.loop.create_task(self.async_worker(args))
+                self.async_tasks.add(task)
+                self.app_tasks.setdefault(name, set()).add(task)
+                task.add_done_callback(functools.partial(self.async_task_done, name))
+            else:
+                self.select_q(args)
             return True
         else:
             return False
@@ -576,6 +757,12 @@ class Threading:
         q = self.get_q(thread_id)
         while True:
             args = q.get()
+            if args is None:
+                # Retired by check_autoscale()
+                q.task_done()
+                break
+            with self.stats_lock:
+                self.max_wait = max(self.max_wait, time.monotonic() - args["queued"])
             _type = args["type"]
             funcref = args["function"]
             _id = args["id"]
@@ -590,9 +777,11 @@ class Threading:
                     app = self.AD.app_management.objects[name]["object"]
             if app is not None:
                 try:
+                    if "timestamp" in args:
+                        self.AD.sched.record_latency("start", name, args["timestamp"])
                     if _type == "scheduler":
                         if self.validate_callback_sig(name, "scheduler", funcref):
-                            self.AD.thread_async.call_async_no_wait(self.update_thread_info, thread_id, callback, name, _type, _id)
+                            self.update_thread_info(thread_id, callback, name, _type, _id)
                             funcref(self.AD.sched.sanitize_timer_kwargs(app, args["kwargs"]))
                     elif _type == "state":
                         if self.validate_callback_sig(name, "state", funcref):
@@ -600,18 +789,18 @@ class Threading:
                             attr = args["attribute"]
                             old_state = args["old_state"]
                             new_state = args["new_state"]
-                            self.AD.thread_async.call_async_no_wait(self.update_thread_info, thread_id, callback, name, _type, _id)
+                            self.update_thread_info(thread_id, callback, name, _type, _id)
                             funcref(entity, attr, old_state, new_state,
                                     self.AD.state.sanitize_state_kwargs(app, args["kwargs"]))
                     elif _type == "event":
                         data = args["data"]
                         if args["event"] == "__AD_LOG_EVENT":
                             if self.validate_callback_sig(name, "log_event", funcref):
-                                self.AD.thread_async.call_async_no_wait(self.update_thread_info, thread_id, callback, name, _type, _id)
+                                self.update_thread_info(thread_id, callback, name, _type, _id)
                                 funcref(data["app_name"], data["ts"], data["level"], data["type"], data["message"], args["kwargs"])
                         else:
                             if self.validate_callback_sig(name, "event", funcref):
-                                self.AD.thread_async.call_async_no_wait(self.update_thread_info, thread_id, callback, name, _type, _id)
+                                self.update_thread_info(thread_id, callback, name, _type, _id)
                                 funcref(args["event"], data, args["kwargs"])
                 except:
                     error_logger.warning('-' * 60,)
@@ -623,7 +812,7 @@ class Threading:
                     if self.AD.logging.separate_error_log() is True:
                         self.logger.warning("Logged an error to %s", self.AD.logging.get_filename("error_log"))
                 finally:
-                    self.AD.thread_async.call_async_no_wait(self.update_thread_info, thread_id, "idle", name, _type, _id)
+                    self.update_thread_info(thread_id, "idle", name, _type, _id)
 
             else:
                 if not self.AD.stopping:
@@ -631,6 +820,85 @@ class Threading:
 
             q.task_done()
 
+    def get_async_semaphore(self, name):
+        if name not in self.async_semaphores:
+            limit = self.AD.app_management.app_config.get(name, {}).get("async_callback_limit", self.AD.async_callback_limit)
+            self.async_semaphores[name] = asyncio.Semaphore(limit)
+        return self.async_semaphores[name]
+
+    def async_task_done(self, name, task):
+        self.async_tasks.discard(task)
+        if name in self.app_tasks:
+            self.app_tasks[name].discard(task)
+            if not self.app_tasks[name]:
+                del self.app_tasks[name]
+
+    def clear_async(self, name):
+        self.async_semaphores.pop(name, None)
+        # Stop any of the app's async callbacks that are still running - may be called from the executor
+        self.AD.loop.call_soon_threadsafe(self.cancel_app_tasks, name)
+
+    def cancel_app_tasks(self, name):
+        for task in list(self.app_tasks.get(name, ())):
+            task.cancel()
+
+    async def wait_for_async_tasks(self):
+        while self.async_tasks:
+            await asyncio.wait(list(self.async_tasks))
+
+    # noinspection PyBroadException
+    async def async_worker(self, args):
+        _type = args["type"]
+        funcref = args["function"]
+        _id = args["id"]
+        objectid = args["objectid"]
+        name = args["name"]
+        error_logger = logging.getLogger("Error.{}".format(name))
+        callback = "{}() in {}".format(funcref.__name__, name)
+        app = None
+        with self.AD.app_management.objects_lock:
+            if name in self.AD.app_management.objects and self.AD.app_management.objects[name]["id"] == objectid:
+                app = self.AD.app_management.objects[name]["object"]
+        if app is None:
+            if not self.AD.stopping:
+                self.logger.warning("Found stale callback for %s - discarding", name)
+            return
+
+        async with self.get_async_semaphore(name):
+            try:
+                if "timestamp" in args:
+                    self.AD.sched.record_latency("start", name, args["timestamp"])
+                if _type == "scheduler":
+                    if self.validate_callback_sig(name, "scheduler", funcref):
+                        self.update_thread_info(None, callback, name, _type, _id)
+                        await funcref(self.AD.sched.sanitize_timer_kwargs(app, args["kwargs"]))
+                elif _type == "state":
+                    if self.validate_callback_sig(name, "state", funcref):
+                        self.update_thread_info(None, callback, name, _type, _id)
+                        await funcref(args["entity"], args["attribute"], args["old_state"], args["new_state"],
+                                      self.AD.state.sanitize_state_kwargs(app, args["kwargs"]))
+                elif _type == "event":
+                    data = args["data"]
+                    if args["event"] == "__AD_LOG_EVENT":
+                        if self.validate_callback_sig(name, "log_event", funcref):
+                            self.update_thread_info(None, callback, name, _type, _id)
+                            await funcref(data["app_name"], data["ts"], data["level"], data["type"], data["message"], args["kwargs"])
+                    else:
+                        if self.validate_callback_sig(name, "event", funcref):
+                            self.update_thread_info(None, callback, name, _type, _id)
+                            await funcref(args["event"], data, args["kwargs"])
+            except:
+                error_logger.warning('-' * 60,)
+                error_logger.warning("Unexpected error in async callback for App %s:", name)
+                error_logger.warning("Worker Ags: %s", args)
+                error_logger.warning('-' * 60)
+                error_logger.warning(traceback.format_exc())
+                error_logger.warning('-' * 60)
+                if self.AD.logging.separate_error_log() is True:
+                    self.logger.warning("Logged an error to %s", self.AD.logging.get_filename("error_log"))
+            finally:
+                self.update_thread_info(None, "idle", name, _type, _id)
+
     def validate_callback_sig(self, name, type, funcref):
 
         callback_args = {
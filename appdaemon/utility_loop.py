@@ -76,6 +76,8 @@ class Utility:
             await self.AD.state.add_entity("admin", "sensor.appdaemon_booted", utils.dt_to_str(self.AD.sched.get_now().replace(microsecond=0), self.AD.tz))
             warning_step = 0
             warning_iterations = 0
+            last_snapshot = datetime.datetime.now().timestamp()
+            last_stats = 0
 
             # Start the loop proper
 
@@ -102,13 +104,39 @@ class Utility:
 
                     warning_step, warning_iterations = self.AD.threading.check_q_size(warning_step, warning_iterations)
 
+                    # Grow or shrink the unpinned threads
+
+                    if self.AD.threading.autoscale_threads is True:
+                        await self.AD.threading.check_autoscale()
+
                     # Check for any overdue threads
 
                     self.AD.threading.check_overdue_and_dead_threads()
 
+                    # Materialize thread and callback stats into the admin namespace
+
+                    if start_time - last_stats >= self.AD.admin_stats_interval:
+                        last_stats = start_time
+                        await self.AD.threading.flush_admin_stats()
+
                     # Save any hybrid namespaces
 
-                    self.AD.state.save_hybrid_namespaces()
+                    await self.AD.state.save_hybrid_namespaces()
+
+                    # Snapshot the scheduler
+
+                    if self.AD.persist_schedule is True and self.AD.apps is True and start_time - last_snapshot >= self.AD.persist_schedule_interval:
+                        last_snapshot = start_time
+                        await utils.run_in_executor(self.AD.loop, self.AD.executor, self.AD.sched.save_snapshot, self.AD.sched.get_snapshot())
+
+                    # Publish timer lateness
+
+                    await self.AD.sched.update_latency_stats()
+
+                    # Publish thread to loop bridge stats
+
+                    if self.AD.thread_async is not None:
+                        await self.AD.thread_async.update_stats()
 
                     # Run utility for each plugin
 
@@ -139,5 +167,11 @@ class Utility:
 
                 await asyncio.sleep(self.AD.utility_delay)
 
+            # Save timers before the apps are terminated and their timers cleared
+
+            if self.AD.persist_schedule is True and self.AD.apps is True:
+                self.AD.sched.save_snapshot(self.AD.sched.get_snapshot())
+
             if self.AD.app_management is not None:
-                self.AD.app_management.terminate()
+                # In the executor so that async terminate() functions can run on the loop
+                await utils.run_in_executor(self.AD.loop, self.AD.executor, self.AD.app_management.terminate)
@@ -10,8 +10,14 @@ import pstats
 import json
 import threading
 import iso8601
+import bisect
+from array import array
 import datetime
 import concurrent.futures
+import sqlite3
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
+from copy import deepcopy
 
 if platform.system() != "Windows":
     import pwd
@@ -70,45 +76,281 @@ class Formatter(object):
 class PersistentDict(dict):
 
     """
-    Persistent Dictionary subclass that uses JSON to persist its contents
+    Persistent Dictionary subclass that uses JSON to persist its contents. In safe mode each
+    change is appended to a journal that is replayed on load and periodically compacted into
+    the main file, so a write costs the same however big the dictionary is.
     """
 
-    def __init__(self, filename, safe, *args, **kwargs):
+    # Compact once the journal has more entries than this or than the dictionary itself
+    COMPACT_MIN = 1000
+
+    def __init__(self, filename, safe, fsync="never", *args, **kwargs):
         super().__init__(**kwargs)
         self.filename = filename
         self.safe = safe
+        # never - leave it to the OS, interval - at most once a second, always - every change
+        self.fsync = fsync
         self.lock = threading.RLock()
+        self.compact_lock = threading.Lock()
+        self.journal_file = "{}.journal".format(filename)
+        self.old_journal_file = "{}.journal.old".format(filename)
+        self.journal = None
+        self.journal_entries = 0
+        self.last_fsync = 0
+        self.compacting = False
         self._load()
 
     def _load(self):
         with self.lock:
             if os.path.isfile(self.filename) and os.path.getsize(self.filename) > 0:
                 with open(self.filename, 'r') as fh:
-                    self.update(False, json.load(fh))
+                    self.update(json.load(fh), save=False)
+            if self.safe is True:
+                # A leftover old journal means we stopped part way through a compaction
+                replayed = self._replay(self.old_journal_file) + self._replay(self.journal_file)
+                if replayed > 0:
+                    self.write(dict(self))
+                self._remove(self.old_journal_file)
+                self._remove(self.journal_file)
+                self.journal = open(self.journal_file, 'a')
+
+    def _replay(self, filename):
+        count = 0
+        if os.path.isfile(filename):
+            with open(filename, 'r') as fh:
+                for line in fh:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn write at the end of the journal - everything before it is good
+                        break
+                    if "d" in entry:
+                        dict.pop(self, entry["d"], None)
+                    else:
+                        dict.__setitem__(self, entry["k"], entry["v"])
+                    count += 1
+        return count
+
+    def write(self, data):
+        # Write to a temporary file and rename so the main file is never left half written
+        tmpfile = "{}.tmp".format(self.filename)
+        with open(tmpfile, 'w') as fh:
+            json.dump(data, fh)
+            if self.fsync != "never":
+                fh.flush()
+                os.fsync(fh.fileno())
+        os.replace(tmpfile, self.filename)
+
+    @staticmethod
+    def _remove(filename):
+        if os.path.isfile(filename):
+            os.remove(filename)
+
+    def _journal(self, entries):
+        # Locking performed in calling function
+        for entry in entries:
+            self.journal.write(json.dumps(entry) + "\n")
+        self.journal.flush()
+        self.journal_entries += len(entries)
+        if self.fsync == "always" or (self.fsync == "interval" and time.time() - self.last_fsync >= 1):
+            os.fsync(self.journal.fileno())
+            self.last_fsync = time.time()
+
+        if self.journal_entries > max(self.COMPACT_MIN, len(self)) and self.compacting is False:
+            self.compacting = True
+            threading.Thread(target=self._compact, daemon=True).start()
+
+    def _compact(self):
+        with self.compact_lock:
+            try:
+                with self.lock:
+                    # Switch to a new journal - the snapshot plus the new journal is everything
+                    data = dict(self)
+                    self.journal.close()
+                    os.replace(self.journal_file, self.old_journal_file)
+                    self.journal = open(self.journal_file, 'a')
+                    self.journal_entries = 0
+                self.write(data)
+                self._remove(self.old_journal_file)
+            finally:
+                self.compacting = False
 
     def save(self):
-        with self.lock:
-            with open(self.filename, 'w') as fh:
-                json.dump(self, fh)
+        if self.safe is True:
+            # Must not hold the lock here - a background compaction may need it to finish
+            self._compact()
+        else:
+            with self.lock:
+                self.write(dict(self))
 
     def __getitem__(self, key):
         return dict.__getitem__(self, key)
 
     def __setitem__(self, key, val):
-        dict.__setitem__(self, key, val)
-        if self.safe is True:
-            self.save()
+        with self.lock:
+            dict.__setitem__(self, key, val)
+            if self.safe is True:
+                self._journal([{"k": key, "v": val}])
+
+    def __delitem__(self, key):
+        with self.lock:
+            dict.__delitem__(self, key)
+            if self.safe is True:
+                self._journal([{"d": key}])
+
+    def pop(self, key, *args):
+        with self.lock:
+            present = key in self
+            value = dict.pop(self, key, *args)
+            if present and self.safe is True:
+                self._journal([{"d": key}])
+            return value
 
     def __repr__(self):
         dictrepr = dict.__repr__(self)
         return '%s(%s)' % (type(self).__name__, dictrepr)
 
-    def update(self, save=True, *args, **kwargs):
-        for k, v in dict(*args, **kwargs).items():
-            self[k] = v
-            if self.safe is True and save is True:
+    def update(self, *args, save=True, **kwargs):
+        with self.lock:
+            items = dict(*args, **kwargs)
+            for k, v in items.items():
+                dict.__setitem__(self, k, v)
+            # One journal write for the whole batch
+            if self.safe is True and save is True and len(items) > 0:
+                self._journal([{"k": k, "v": v} for k, v in items.items()])
+
+
+class SqliteDict(MutableMapping):
+
+    """
+    Dictionary backed by an SQLite database, for namespaces too big to hold and save as a
+    single JSON document. Only the keys are read at startup - values are read when first
+    used and kept in an LRU cache, and writes are batched into a single transaction.
+    """
+
+    def __init__(self, filename, cache_size=1000, batch_size=100):
+        self.filename = filename
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.lock = threading.RLock()
+        self.cache = OrderedDict()
+        # Serialized values waiting to be written, None for a delete
+        self.pending = {}
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS entities (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.entity_keys = dict.fromkeys(row[0] for row in self.db.execute("SELECT key FROM entities"))
+
+    def _cache(self, key, value):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def __getitem__(self, key):
+        with self.lock:
+            if key not in self.entity_keys:
+                raise KeyError(key)
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            if key in self.pending:
+                value = json.loads(self.pending[key])
+            else:
+                row = self.db.execute("SELECT value FROM entities WHERE key = ?", (key,)).fetchone()
+                value = json.loads(row[0])
+            self._cache(key, value)
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.pending[key] = json.dumps(value)
+            self.entity_keys[key] = None
+            self._cache(key, value)
+            if len(self.pending) >= self.batch_size:
+                self.save()
+
+    def __delitem__(self, key):
+        with self.lock:
+            if key not in self.entity_keys:
+                raise KeyError(key)
+            del self.entity_keys[key]
+            self.cache.pop(key, None)
+            self.pending[key] = None
+            if len(self.pending) >= self.batch_size:
                 self.save()
 
+    def __contains__(self, key):
+        return key in self.entity_keys
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.entity_keys))
+
+    def __len__(self):
+        return len(self.entity_keys)
+
+    def __repr__(self):
+        return '%s(%s, %s entities)' % (type(self).__name__, self.filename, len(self))
+
+    def save(self):
+        with self.lock:
+            if len(self.pending) == 0:
+                return
+            writes = [(key, value) for key, value in self.pending.items() if value is not None]
+            deletes = [(key,) for key, value in self.pending.items() if value is None]
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO entities (key, value) VALUES (?, ?)", writes)
+                self.db.executemany("DELETE FROM entities WHERE key = ?", deletes)
+            self.pending = {}
+
+
+class HistoryBuffer:
+
+    """
+    Ring buffer of (timestamp, state) pairs for an entity. Timestamps are held in a float
+    array and states in a parallel list, growing until the buffer is full then wrapping.
+    """
+
+    __slots__ = ("size", "max_age", "times", "states", "start")
+
+    def __init__(self, size, max_age=None):
+        self.size = size
+        self.max_age = max_age
+        self.times = array("d")
+        self.states = []
+        self.start = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def last(self):
+        if len(self.times) == 0:
+            return None
+        return self.states[(self.start - 1) % len(self.times)]
+
+    def append(self, ts, state):
+        if len(self.times) < self.size:
+            self.times.append(ts)
+            self.states.append(state)
+        else:
+            self.times[self.start] = ts
+            self.states[self.start] = state
+            self.start = (self.start + 1) % self.size
+
+    def get(self, since=None, limit=None, now=None):
+        # Oldest first - unwrap the buffer so we can bisect on the timestamps
+        times = self.times[self.start:] + self.times[:self.start]
+        states = self.states[self.start:] + self.states[:self.start]
+        first = 0
+        if self.max_age is not None and now is not None:
+            first = bisect.bisect_left(times, now - self.max_age)
+        if since is not None:
+            first = max(first, bisect.bisect_left(times, since))
+        if limit is not None:
+            first = max(first, len(times) - limit)
+        return list(zip(times[first:], states[first:]))
+
 
 class AttrDict(dict):
     """ Dictionary subclass whose entries can be accessed by attributes
@@ -122,29 +364,75 @@ class AttrDict(dict):
     @staticmethod
     def from_nested_dict(data):
         """ Construct nested AttrDicts from nested dictionaries. """
-        if not isinstance(data, dict):
+        if not isinstance(data, Mapping):
             return data
         else:
             return AttrDict({key: AttrDict.from_nested_dict(data[key])
                              for key in data})
 
 
+class StateView(Mapping):
+
+    """
+    Read only view over shared state - nested dictionaries are wrapped as they are accessed
+    and lists are returned as tuples, so the state can't be modified through the view
+    """
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        return freeze_state(self._data[key])
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, repr(self._data))
+
+    def copy(self):
+        # A private, writable copy
+        return deepcopy(self._data)
+
+
+def freeze_state(value):
+    if isinstance(value, dict):
+        return StateView(value)
+    elif isinstance(value, list):
+        return tuple(freeze_state(item) for item in value)
+    else:
+        return value
+
+
+def thaw_state(value):
+    # Counterpart of freeze_state() - turns views (or any mapping) and tuples back into plain dicts and lists
+    if isinstance(value, Mapping):
+        return {key: thaw_state(item) for key, item in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [thaw_state(item) for item in value]
+    else:
+        return value
+
+
 class StateAttrs(dict):
     def __init__(self, dict):
-        device_dict = {}
-        devices = set()
+        # Group by domain in a single pass rather than rescanning for each domain
+        entities = {}
         for entity in dict:
             if "." in entity:
-                device, name = entity.split(".")
-                devices.add(device)
-        for device in devices:
-            entity_dict = {}
-            for entity in dict:
-                if "." in entity:
-                    thisdevice, name = entity.split(".")
-                    if device == thisdevice:
-                        entity_dict[name] = dict[entity]
-            device_dict[device] = AttrDict.from_nested_dict(entity_dict)
+                device, name = entity.split(".", 1)
+                entities.setdefault(device, {})[name] = dict[entity]
+        device_dict = {}
+        for device in entities:
+            device_dict[device] = AttrDict.from_nested_dict(entities[device])
 
         self.__dict__ = device_dict
 